@@ -89,6 +89,18 @@ def convert_pdf_to_images(pdf_path: str, output_dir: Optional[str] = None) -> Li
         print(f"Erro ao converter PDF para imagens: {e}")
         raise
 
+_OCR = None
+_OCR_LANG = None
+
+def _get_ocr(lang: str):
+    """Instância única do PaddleOCR por processo (o modelo carrega uma vez)"""
+    global _OCR, _OCR_LANG
+    if _OCR is None or _OCR_LANG != lang:
+        from paddleocr import PaddleOCR
+        _OCR = PaddleOCR(use_angle_cls=True, lang=lang)
+        _OCR_LANG = lang
+    return _OCR
+
 def run_paddle_ocr(image_path: str, lang: str = "pt") -> List[Dict[str, Any]]:
     """
     Executar PaddleOCR em uma imagem para extrair texto e posições
@@ -101,11 +113,8 @@ def run_paddle_ocr(image_path: str, lang: str = "pt") -> List[Dict[str, Any]]:
         Lista de resultados OCR com texto e caixas delimitadoras
     """
     try:
-        from paddleocr import PaddleOCR
-        
         print(f"Executando OCR na imagem: {image_path}")
-        ocr = PaddleOCR(use_angle_cls=True, lang=lang)
-        results = ocr.ocr(image_path, cls=True)
+        results = _get_ocr(lang).ocr(image_path, cls=True)
         
         # Formatar resultados
         formatted_results = []
@@ -210,7 +219,9 @@ def is_price(text: str) -> Tuple[bool, Optional[float]]:
             # Decisão final
             if has_indicator or (is_reasonable_price and (len(text) < 20 or price_match.group(0) == text)):
                 return True, price
-    
+        except ValueError:
+            pass
+
     return False, None
 
 def is_product_code(text: str) -> bool:
@@ -612,9 +623,10 @@ def process_pdf_with_paddle_ocr(pdf_path: str, output_json_path: Optional[str] =
     Returns:
         Caminho para o arquivo JSON de saída
     """
-    # Instalar dependências se necessário
-    install_dependencies()
-    
+    # Dependências são instaladas fora do caminho quente — uma vez, via
+    # `python paddle_ocr_extractor.py --install` ou no provisionamento do
+    # ambiente; o pip resolver levava segundos por invocação
+
     # Verificar poppler
     if not check_poppler():
         raise RuntimeError("Poppler não está instalado. Instale-o antes de prosseguir.")
@@ -664,6 +676,10 @@ def process_pdf_with_paddle_ocr(pdf_path: str, output_json_path: Optional[str] =
     return output_json_path
 
 if __name__ == "__main__":
+    if "--install" in sys.argv:
+        install_dependencies()
+        sys.exit(0)
+
     # Verificar argumentos
     if len(sys.argv) < 2:
         print("Uso: python paddle_ocr_extractor.py <caminho_do_pdf> [caminho_do_json_saida]")
@@ -1,12 +1,55 @@
+import itertools
+import mmap
 import os
 import json
-import base64
+
+try:
+    import pybase64 as _b64  # encode SIMD (libbase64); stdlib como reserva
+except ImportError:
+    import base64 as _b64
 import subprocess
 import tempfile
 from pathlib import Path
 import re
 from typing import List, Dict, Any, Tuple
 
+try:
+    import orjson
+    def _dumps_indented(obj):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+except ImportError:
+    def _dumps_indented(obj):
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+
+# Padrões dos predicados quentes compilados uma vez no import — o laço de
+# grupos de OCR os consulta para cada linha reconhecida na página
+_PRICE_RE = re.compile(r'R\$\s*\d+[.,]?\d*')
+_CODE_RE = re.compile(r'\d+\.\d+\.\d+\.\d+')  # códigos Fratini: 1.00020.01.0001
+_GENERIC_CODE_RE = re.compile(r'[A-Z0-9]{4,}')
+_PAGE_NUM_RE = re.compile(r'-(\d+)\.jpg$')
+
+# Product names often start with "Cadeira", "Mesa", "Poltrona", etc.
+# startswith com tupla checa todas as alternativas numa única passada em C
+_PRODUCT_PREFIXES = ("cadeira", "mesa", "poltrona", "sofá", "sofa", "banqueta",
+                     "apoio", "estante", "armário", "armario", "rack", "bancada")
+# Duas palavras seguidas começando com maiúscula (inclui acentuadas)
+_CAP2_RE = re.compile(r'^[A-ZÀ-Ý]\S*\s+[A-ZÀ-Ý]')
+
+# Cores reconhecidas nos textos de OCR. A alternância compilada varre o texto
+# uma única vez em C, no lugar de um laço Python com um `cor in texto` por cor
+# (O(cores x len(texto)) por grupo) — e o laço rodava duas vezes: no is_color
+# e de novo ao popular o produto.
+_COLORS = ("preto", "branco", "cinza", "azul", "vermelho", "verde",
+           "amarelo", "laranja", "roxo", "rosa", "marrom", "bege",
+           "prata", "dourado", "cromado", "natural", "madeira")
+_COLOR_RE = re.compile('|'.join(_COLORS))
+# Subconjunto que o extrator efetivamente grava em "cores"
+_PRODUCT_COLORS = _COLORS[:12]
+
+def find_colors(text_lower: str) -> set:
+    """Cores presentes no texto (já em minúsculas), em uma única varredura"""
+    return set(_COLOR_RE.findall(text_lower))
+
 def install_dependencies():
     """Install required Python dependencies"""
     try:
@@ -53,12 +96,12 @@ def convert_pdf_to_images(pdf_path: str, output_dir: str = None) -> List[str]:
             pdf_path, os.path.join(output_dir, base_name)
         ])
         
-        # Get list of generated images
-        image_paths = sorted([
-            os.path.join(output_dir, f) 
-            for f in os.listdir(output_dir) 
-            if f.startswith(base_name) and f.endswith('.jpg')
-        ])
+        # Get list of generated images (scandir devolve nome e caminho na
+        # mesma passada pelo diretório, sem stat extra por arquivo)
+        with os.scandir(output_dir) as entries:
+            image_paths = sorted(
+                entry.path for entry in entries
+                if entry.name.startswith(base_name) and entry.name.endswith('.jpg'))
         
         print(f"Converted PDF to {len(image_paths)} images")
         return image_paths
@@ -66,26 +109,38 @@ def convert_pdf_to_images(pdf_path: str, output_dir: str = None) -> List[str]:
         print(f"Error converting PDF to images: {e}")
         return []
 
+_OCR = None
+_OCR_LANG = None
+
+def _get_ocr(lang: str):
+    """
+    Instância única do PaddleOCR por processo.
+
+    Construir o objeto recarrega do disco os pesos do detector, do
+    reconhecedor e do classificador de ângulo (centenas de MB); para um
+    pipeline de N páginas isso dominava o tempo total de OCR.
+    """
+    global _OCR, _OCR_LANG
+    if _OCR is None or _OCR_LANG != lang:
+        from paddleocr import PaddleOCR
+        _OCR = PaddleOCR(use_angle_cls=True, lang=lang)
+        _OCR_LANG = lang
+    return _OCR
+
 def run_ocr_on_image(image_path: str, lang: str = "pt") -> List[Dict[str, Any]]:
     """
     Run PaddleOCR on an image
-    
+
     Args:
         image_path: Path to the image
         lang: Language code (pt for Portuguese)
-        
+
     Returns:
         List of OCR results with text and bounding boxes
     """
     try:
-        # Install and import paddleocr
-        from paddleocr import PaddleOCR
-        
-        # Initialize PaddleOCR
-        ocr = PaddleOCR(use_angle_cls=True, lang=lang)
-        
-        # Run OCR
-        result = ocr.ocr(image_path, cls=True)
+        # Run OCR (instância cacheada — o modelo carrega uma vez)
+        result = _get_ocr(lang).ocr(image_path, cls=True)
         
         # Process results
         ocr_results = []
@@ -110,59 +165,52 @@ def run_ocr_on_image(image_path: str, lang: str = "pt") -> List[Dict[str, Any]]:
         print(f"Error running OCR on image: {e}")
         return []
 
-def is_product_name(text: str) -> bool:
-    """Check if text is likely to be a product name"""
-    # Product names often start with "Cadeira", "Mesa", "Poltrona", etc.
-    product_prefixes = ["cadeira", "mesa", "poltrona", "sofá", "sofa", "banqueta", 
-                        "apoio", "estante", "armário", "armario", "rack", "bancada"]
-    
-    text_lower = text.lower()
-    
+def run_ocr_on_images(image_paths: List[str], lang: str = "pt") -> List[List[Dict[str, Any]]]:
+    """
+    Run PaddleOCR on a batch of images, reusing one model instance
+
+    Args:
+        image_paths: List of image paths (one per page)
+        lang: Language code (pt for Portuguese)
+
+    Returns:
+        List of OCR result lists, in the same order as image_paths
+    """
+    return [run_ocr_on_image(image_path, lang) for image_path in image_paths]
+
+def is_product_name(text: str, text_lower: str = None) -> bool:
+    """Check if text is likely to be a product name
+
+    Aceita o texto já em minúsculas para não refazer o case-folding que o
+    laço de grupos de OCR já pagou.
+    """
+    if text_lower is None:
+        text_lower = text.lower()
+
     # Check if text starts with any of the prefixes
-    for prefix in product_prefixes:
-        if text_lower.startswith(prefix):
-            return True
-    
-    # Check for capitalized words which might be product names
-    words = text.split()
-    if len(words) >= 2 and words[0][0].isupper() and words[1][0].isupper():
+    if text_lower.startswith(_PRODUCT_PREFIXES):
         return True
-    
-    return False
+
+    # Check for capitalized words which might be product names
+    return bool(_CAP2_RE.match(text))
 
 def is_price(text: str) -> bool:
     """Check if text contains a price"""
     # Look for "R$" followed by numbers
-    return bool(re.search(r'R\$\s*\d+[.,]?\d*', text))
+    return bool(_PRICE_RE.search(text))
 
 def is_product_code(text: str) -> bool:
     """Check if text is likely to be a product code"""
     # Fratini codes are like 1.00020.01.0001
-    if re.search(r'\d+\.\d+\.\d+\.\d+', text):
+    if _CODE_RE.search(text):
         return True
-    
+
     # Generic product codes often contain letters and numbers
-    return bool(re.search(r'[A-Z0-9]{4,}', text))
+    return bool(_GENERIC_CODE_RE.search(text))
 
 def is_color(text: str) -> bool:
     """Check if text is likely to be a color name"""
-    colors = ["preto", "branco", "cinza", "azul", "vermelho", "verde", 
-              "amarelo", "laranja", "roxo", "rosa", "marrom", "bege", 
-              "prata", "dourado", "cromado", "natural", "madeira"]
-    
-    text_lower = text.lower()
-    
-    # Check exact matches first
-    for color in colors:
-        if color == text_lower:
-            return True
-    
-    # Check if any color is contained in the text
-    for color in colors:
-        if color in text_lower:
-            return True
-    
-    return False
+    return bool(_COLOR_RE.search(text.lower()))
 
 def extract_products_from_ocr_results(ocr_results_by_page: List[List[Dict]], page_images: List[str]) -> List[Dict]:
     """
@@ -183,45 +231,37 @@ def extract_products_from_ocr_results(ocr_results_by_page: List[List[Dict]], pag
         try:
             # Extract page number from the filename
             filename = os.path.basename(page_images[idx])
-            match = re.search(r'-(\d+)\.jpg$', filename)
+            match = _PAGE_NUM_RE.search(filename)
             if match:
                 return int(match.group(1))
             return idx + 1
         except:
             return idx + 1
     
+    def _row_bucket(result):
+        """Group items that are within 20 pixels vertically"""
+        return int(result['center'][1] / 20)
+
     # Process each page
     for page_idx, page_results in enumerate(ocr_results_by_page):
-        # Group text elements by vertical position (allow small differences)
-        vertical_groups = {}
-        
-        for result in page_results:
-            text = result['text'].strip()
-            if not text:
-                continue
-                
-            center_y = result['center'][1]
-            # Group items that are within 20 pixels vertically
-            group_key = int(center_y / 20)
-            
-            if group_key not in vertical_groups:
-                vertical_groups[group_key] = []
-            
-            vertical_groups[group_key].append(result)
-        
-        # Sort groups by vertical position
-        sorted_groups = sorted(vertical_groups.items())
-        
+        # Uma única ordenação global por (balde vertical, x) substitui o
+        # dict de baldes + uma ordenação por grupo: o Timsort em C resolve
+        # as duas de uma vez e o groupby apenas fatia a sequência ordenada
+        ordered = sorted(
+            (r for r in page_results if r['text'].strip()),
+            key=lambda r: (_row_bucket(r), r['center'][0]))
+
         # Process each vertical group
-        for _, group in sorted_groups:
-            # Sort items within group by horizontal position
-            sorted_items = sorted(group, key=lambda x: x['center'][0])
-            
-            # Concatenate all text in the group
+        for _, group_items in itertools.groupby(ordered, key=_row_bucket):
+            sorted_items = list(group_items)
+
+            # Concatenate all text in the group; o lower() é calculado uma
+            # única vez e repassado aos predicados
             group_text = " ".join([item['text'] for item in sorted_items])
-            
+            group_text_lower = group_text.lower()
+
             # Look for product name patterns
-            if is_product_name(group_text):
+            if is_product_name(group_text, group_text_lower):
                 # If we were processing a product, save it
                 if current_product:
                     products.append(current_product)
@@ -239,27 +279,26 @@ def extract_products_from_ocr_results(ocr_results_by_page: List[List[Dict]], pag
             
             # Process already found product
             elif current_product:
-                # Check for price information
-                if is_price(group_text):
-                    # Extract the price
-                    price_match = re.search(r'R\$\s*\d+[.,]?\d*', group_text)
-                    if price_match:
-                        current_product["preco"] = price_match.group(0)
-                
-                # Check for product code
-                elif is_product_code(group_text):
-                    code_match = re.search(r'\d+\.\d+\.\d+\.\d+', group_text)
+                # Check for price information — o mesmo search gateia o ramo
+                # e extrai o valor, sem a segunda varredura do texto
+                if (price_match := _PRICE_RE.search(group_text)):
+                    current_product["preco"] = price_match.group(0)
+
+                # Check for product code. O padrão genérico continua só
+                # gateando o ramo (como no is_product_code); o pontuado
+                # gateia e extrai de uma vez
+                elif (code_match := _CODE_RE.search(group_text)) \
+                        or _GENERIC_CODE_RE.search(group_text):
                     if code_match:
                         code = code_match.group(0)
                         if code not in current_product["codigo_comercial"]:
                             current_product["codigo_comercial"].append(code)
                 
-                # Check for colors
-                elif is_color(group_text):
-                    # Extract known colors
-                    for color in ["preto", "branco", "cinza", "azul", "vermelho", "verde", 
-                                "amarelo", "laranja", "roxo", "rosa", "marrom", "bege"]:
-                        if color in group_text.lower() and color not in current_product["cores"]:
+                # Check for colors — a mesma varredura gateia o ramo e
+                # popula o produto
+                elif (found_colors := find_colors(group_text_lower)):
+                    for color in _PRODUCT_COLORS:
+                        if color in found_colors and color not in current_product["cores"]:
                             current_product["cores"].append(color.capitalize())
                 
                 # If not identified as a special field, add to description
@@ -273,17 +312,32 @@ def extract_products_from_ocr_results(ocr_results_by_page: List[List[Dict]], pag
     if current_product:
         products.append(current_product)
     
-    # Post-process products
+    # Post-process products. Todos os produtos de uma página apontam para a
+    # mesma imagem; cada arquivo é lido e codificado uma única vez e o data
+    # URI resultante é compartilhado entre eles
+    data_uri_by_path = {}
     for product in products:
         # Convert image path to base64
         try:
-            with open(product["imagem"], "rb") as img_file:
-                img_data = base64.b64encode(img_file.read()).decode('utf-8')
-                product["imagem"] = f"data:image/jpeg;base64,{img_data}"
+            image_path = product["imagem"]
+            data_uri = data_uri_by_path.get(image_path)
+            if data_uri is None:
+                with open(image_path, "rb") as img_file:
+                    # Acima de 1 MB o mmap deixa o encode paginar os bytes
+                    # sob demanda, sem alocar a cópia completa em Python
+                    if os.fstat(img_file.fileno()).st_size > 1024 * 1024:
+                        with mmap.mmap(img_file.fileno(), 0,
+                                       access=mmap.ACCESS_READ) as mapped:
+                            img_data = _b64.b64encode(mapped).decode('utf-8')
+                    else:
+                        img_data = _b64.b64encode(img_file.read()).decode('utf-8')
+                data_uri = f"data:image/jpeg;base64,{img_data}"
+                data_uri_by_path[image_path] = data_uri
+            product["imagem"] = data_uri
         except Exception as e:
             print(f"Error converting image to base64: {e}")
             product["imagem"] = ""
-        
+
         # Make sure we have at least empty arrays for required fields
         if not product["codigo_comercial"]:
             product["codigo_comercial"] = []
@@ -306,9 +360,11 @@ def process_pdf_with_ocr(pdf_path: str, output_json_path: str = None, lang: str
         Path to the output JSON file
     """
     try:
-        # Install dependencies if needed
-        install_dependencies()
-        
+        # Dependências (paddleocr, pdf2image etc.) são instaladas fora do
+        # caminho quente — uma vez, via `python pdf_ocr_processor.py --install`
+        # ou no provisionamento do ambiente. O pip resolver levava segundos
+        # por invocação mesmo com tudo já instalado.
+
         # Create temporary directory for images
         temp_dir = tempfile.mkdtemp()
         
@@ -318,11 +374,8 @@ def process_pdf_with_ocr(pdf_path: str, output_json_path: str = None, lang: str
         if not image_paths:
             raise Exception("Failed to convert PDF to images")
         
-        # Run OCR on each image
-        ocr_results_by_page = []
-        for image_path in image_paths:
-            ocr_results = run_ocr_on_image(image_path, lang)
-            ocr_results_by_page.append(ocr_results)
+        # Run OCR on each image (uma instância de modelo para o lote todo)
+        ocr_results_by_page = run_ocr_on_images(image_paths, lang)
         
         # Extract products from OCR results
         products = extract_products_from_ocr_results(ocr_results_by_page, image_paths)
@@ -332,8 +385,10 @@ def process_pdf_with_ocr(pdf_path: str, output_json_path: str = None, lang: str
             output_json_path = os.path.join(os.path.dirname(pdf_path), 
                                            f"{os.path.splitext(os.path.basename(pdf_path))[0]}_products.json")
         
-        with open(output_json_path, 'w', encoding='utf-8') as f:
-            json.dump(products, f, ensure_ascii=False, indent=2)
+        # orjson escreve bytes e não paga o passo de escape do ensure_ascii
+        # sobre os data URIs base64 embutidos nos produtos
+        with open(output_json_path, 'wb') as f:
+            f.write(_dumps_indented(products))
         
         print(f"Extracted {len(products)} products from PDF")
         print(f"Results saved to {output_json_path}")
@@ -345,7 +400,11 @@ def process_pdf_with_ocr(pdf_path: str, output_json_path: str = None, lang: str
 
 if __name__ == "__main__":
     import sys
-    
+
+    if "--install" in sys.argv:
+        install_dependencies()
+        sys.exit(0)
+
     if len(sys.argv) < 2:
         print("Usage: python pdf_ocr_processor.py <pdf_path> [output_json_path]")
         sys.exit(1)
@@ -11,6 +11,53 @@ import io
 from io import BytesIO
 from PIL import Image
 
+try:
+    import orjson  # Serializador JSON nativo, muito mais rápido para payloads grandes
+except ImportError:
+    orjson = None
+
+def print_json(result):
+    """Escreve o resultado como JSON no stdout.
+
+    Com orjson os bytes vão direto para o buffer do stdout, sem construir a
+    string intermediária do json.dumps (relevante quando o payload inclui
+    base64 de várias imagens).
+    """
+    if orjson is not None:
+        sys.stdout.buffer.write(orjson.dumps(result))
+        sys.stdout.buffer.write(b'\n')
+        sys.stdout.buffer.flush()
+    else:
+        print(json.dumps(result))
+
+# Extensões de imagem e prefixos de pasta de mídia reconhecidos dentro do ZIP.
+# Comparações com str.endswith/substring são puro C e saem bem mais baratas
+# que a maquinaria de regex com IGNORECASE rodando por entrada do arquivo.
+IMG_EXTS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.emf', '.wmf')
+MEDIA_PREFIXES = ('xl/media/', 'xl/drawings/', 'word/media/', 'ppt/media/')
+
+def read_zip_entry(excel_zip, name):
+    """Lê os bytes de uma entrada do ZIP.
+
+    PNG/JPEG já comprimidos costumam ser gravados como ZIP_STORED; nesse caso
+    o tamanho final é conhecido, então pré-alocamos o buffer e usamos readinto
+    para evitar as realocações do bytearray crescente dentro de read().
+    """
+    info = excel_zip.getinfo(name)
+    if info.compress_type == zipfile.ZIP_STORED and info.file_size > 0:
+        buf = bytearray(info.file_size)
+        mv = memoryview(buf)
+        pos = 0
+        with excel_zip.open(info) as src:
+            while pos < len(buf):
+                n = src.readinto(mv[pos:])
+                if not n:
+                    break
+                pos += n
+        return bytes(buf[:pos]) if pos < len(buf) else bytes(buf)
+    with excel_zip.open(info) as src:
+        return src.read()
+
 def extract_images_from_excel(excel_path, output_dir):
     """Extrai imagens de um arquivo Excel usando múltiplos métodos"""
     result = {
@@ -27,14 +74,26 @@ def extract_images_from_excel(excel_path, output_dir):
     try:
         # Garantir que o diretório de saída existe
         os.makedirs(output_dir, exist_ok=True)
-        
+
+        # Normalizar o diretório de saída uma vez; os nomes de arquivo são
+        # montados diretamente, sem re-parsear com os.path.basename depois
+        output_dir_sl = output_dir.rstrip('/\\') + os.sep
+
         # Método 1: Extrair diretamente do ZIP (Excel é um arquivo ZIP)
         debug_log(f"Método 1: Extraindo do ZIP - {excel_path}")
         with zipfile.ZipFile(excel_path, 'r') as excel_zip:
-            # Procurar por arquivos de imagem em locais comuns
-            image_paths = [f for f in excel_zip.namelist() if
-                          re.search(r'\.(png|jpe?g|gif|bmp|tiff|emf|wmf)$', f, re.IGNORECASE) and
-                          ('xl/media/' in f or 'xl/drawings/' in f or 'word/media/' in f or 'ppt/media/' in f)]
+            # Ler o diretório central do ZIP uma única vez e particionar as
+            # entradas (imagens e .rels) em uma só passada, em vez de
+            # reconstruir a lista em cada método
+            names = excel_zip.namelist()
+            image_paths = []
+            rels_files = []
+            for f in names:
+                fl = f.lower()
+                if fl.endswith(IMG_EXTS) and any(p in fl for p in MEDIA_PREFIXES):
+                    image_paths.append(f)
+                elif fl.endswith('.rels'):
+                    rels_files.append(f)
             
             debug_log(f"Encontrados {len(image_paths)} arquivos de imagem no Excel")
             
@@ -46,52 +105,51 @@ def extract_images_from_excel(excel_path, output_dir):
                     # Remover caracteres problemáticos
                     safe_filename = re.sub(r'[^\w\-\.]', '_', img_filename)
                     # Adicionar índice para evitar sobreposição
-                    temp_path = os.path.join(output_dir, f"img_{img_index}_{safe_filename}")
+                    basename = f"img_{img_index}_{safe_filename}"
+                    temp_path = output_dir_sl + basename
                     
-                    # Extrair a imagem para o disco
-                    with excel_zip.open(img_path) as img_file:
-                        img_data = img_file.read()
-                        
-                        # Verificar se os dados são válidos
-                        if len(img_data) == 0:
-                            debug_log(f"Dados vazios para imagem {img_path}")
-                            continue
-                        
-                        with open(temp_path, 'wb') as out_file:
-                            out_file.write(img_data)
-                        
-                        # Verificar integridade da imagem
-                        try:
-                            with Image.open(BytesIO(img_data)) as img:
-                                img_format = img.format.lower() if img.format else 'png'
-                                img_width, img_height = img.size
-                                debug_log(f"Imagem válida: {img_width}x{img_height} formato {img_format}")
-                        except Exception as img_err:
-                            debug_log(f"Aviso: Erro ao validar imagem {img_path}: {str(img_err)}")
-                            # Continuar mesmo com erro na validação
-                        
-                        # Converter para base64 para retorno
-                        img_base64 = base64.b64encode(img_data).decode('utf-8')
-                        
-                        # Adicionar ao resultado
-                        result["images"].append({
-                            "image_path": temp_path,
-                            "image_filename": os.path.basename(temp_path),
-                            "original_path": img_path,
-                            "image_base64": img_base64,
-                            "index": img_index
-                        })
-                        
-                        debug_log(f"Imagem {img_index+1} extraída: {temp_path}")
+                    # Extrair a imagem para o disco (leitura com buffer pré-alocado
+                    # para entradas STORED)
+                    img_data = read_zip_entry(excel_zip, img_path)
+
+                    # Verificar se os dados são válidos
+                    if len(img_data) == 0:
+                        debug_log(f"Dados vazios para imagem {img_path}")
+                        continue
+
+                    with open(temp_path, 'wb') as out_file:
+                        out_file.write(img_data)
+
+                    # Verificar integridade da imagem
+                    try:
+                        with Image.open(BytesIO(img_data)) as img:
+                            img_format = img.format.lower() if img.format else 'png'
+                            img_width, img_height = img.size
+                            debug_log(f"Imagem válida: {img_width}x{img_height} formato {img_format}")
+                    except Exception as img_err:
+                        debug_log(f"Aviso: Erro ao validar imagem {img_path}: {str(img_err)}")
+                        # Continuar mesmo com erro na validação
+
+                    # Converter para base64 para retorno
+                    img_base64 = base64.b64encode(img_data).decode('utf-8')
+
+                    # Adicionar ao resultado
+                    result["images"].append({
+                        "image_path": temp_path,
+                        "image_filename": basename,
+                        "original_path": img_path,
+                        "image_base64": img_base64,
+                        "index": img_index
+                    })
+
+                    debug_log(f"Imagem {img_index+1} extraída: {temp_path}")
                 except Exception as e:
                     debug_log(f"Erro ao extrair imagem {img_path}: {str(e)}")
             
             # Se não encontramos imagens no método 1, tentar método alternativo
             if len(result["images"]) == 0:
                 debug_log("Método 2: Tentando método via arquivos de relações...")
-                # Procurar por arquivos de relação que possam conter referências a imagens
-                rels_files = [f for f in excel_zip.namelist() if f.endswith('.rels')]
-                
+                # Usar os arquivos de relação já particionados na leitura do ZIP
                 for rel_file in rels_files:
                     try:
                         with excel_zip.open(rel_file) as f:
@@ -105,24 +163,24 @@ def extract_images_from_excel(excel_path, output_dir):
                                 img_path = os.path.normpath(os.path.join(rel_dir, img_ref))
                                 
                                 try:
-                                    with excel_zip.open(img_path) as img_file:
-                                        img_data = img_file.read()
-                                        img_filename = os.path.basename(img_path)
-                                        safe_filename = re.sub(r'[^\w\-\.]', '_', img_filename)
-                                        temp_path = os.path.join(output_dir, f"rel_{len(result['images'])}_{safe_filename}")
-                                        
-                                        with open(temp_path, 'wb') as out_file:
-                                            out_file.write(img_data)
-                                        
-                                        img_base64 = base64.b64encode(img_data).decode('utf-8')
-                                        
-                                        result["images"].append({
-                                            "image_path": temp_path,
-                                            "image_filename": os.path.basename(temp_path),
-                                            "original_path": img_path,
-                                            "image_base64": img_base64,
-                                            "index": len(result["images"])
-                                        })
+                                    img_data = read_zip_entry(excel_zip, img_path)
+                                    img_filename = os.path.basename(img_path)
+                                    safe_filename = re.sub(r'[^\w\-\.]', '_', img_filename)
+                                    basename = f"rel_{len(result['images'])}_{safe_filename}"
+                                    temp_path = output_dir_sl + basename
+
+                                    with open(temp_path, 'wb') as out_file:
+                                        out_file.write(img_data)
+
+                                    img_base64 = base64.b64encode(img_data).decode('utf-8')
+
+                                    result["images"].append({
+                                        "image_path": temp_path,
+                                        "image_filename": basename,
+                                        "original_path": img_path,
+                                        "image_base64": img_base64,
+                                        "index": len(result["images"])
+                                    })
                                 except Exception as e:
                                     debug_log(f"Erro ao extrair imagem da referência {img_ref}: {str(e)}")
                     except Exception as e:
@@ -162,7 +220,7 @@ def extract_images_from_excel(excel_path, output_dir):
                                 
                                 # Criar nome de arquivo
                                 safe_filename = f"openpyxl_{sheet_name}_{img_idx}.png"
-                                temp_path = os.path.join(output_dir, safe_filename)
+                                temp_path = output_dir_sl + safe_filename
                                 
                                 # Salvar no disco
                                 with open(temp_path, 'wb') as out_file:
@@ -174,7 +232,7 @@ def extract_images_from_excel(excel_path, output_dir):
                                 # Adicionar ao resultado
                                 result["images"].append({
                                     "image_path": temp_path,
-                                    "image_filename": os.path.basename(temp_path),
+                                    "image_filename": safe_filename,
                                     "original_path": f"{sheet_name}:image{img_idx}",
                                     "image_base64": img_base64,
                                     "index": len(result["images"]),
@@ -242,7 +300,7 @@ def extract_images_from_excel(excel_path, output_dir):
                             # Gerar nome único
                             extension = info['ext']
                             safe_filename = f"raw_{total_found}.{extension}"
-                            temp_path = os.path.join(output_dir, safe_filename)
+                            temp_path = output_dir_sl + safe_filename
                             
                             # Salvar no disco
                             with open(temp_path, 'wb') as out_file:
@@ -253,7 +311,7 @@ def extract_images_from_excel(excel_path, output_dir):
                             
                             result["images"].append({
                                 "image_path": temp_path,
-                                "image_filename": os.path.basename(temp_path),
+                                "image_filename": safe_filename,
                                 "original_path": f"raw_offset_{pos}",
                                 "image_base64": img_base64,
                                 "index": len(result["images"])
@@ -275,7 +333,7 @@ def extract_images_from_excel(excel_path, output_dir):
         debug_log(f"Erro geral: {str(e)}")
     
     # Retornar o resultado como JSON
-    print(json.dumps(result))
+    print_json(result)
     return result
 
 def associate_images_with_products(excel_path, images, output_dir):
@@ -291,23 +349,59 @@ def associate_images_with_products(excel_path, images, output_dir):
         print(message, file=sys.stderr)
     
     try:
-        import openpyxl
-        
-        # Carregar workbook
-        wb = openpyxl.load_workbook(excel_path, data_only=True)
-        first_sheet = wb.active
-        
+        # A associação só precisa dos VALORES das células (cabeçalhos + colunas
+        # de código), nunca de formatação ou imagens. Carregar cada planilha
+        # uma única vez como tabela de valores em memória, limitada a
+        # 1000 linhas x 20 colunas. Usar python-calamine quando disponível
+        # (parser nativo, ordens de grandeza mais rápido que o openpyxl para
+        # leitura de valores); caso contrário, cair para openpyxl em modo
+        # read_only/data_only.
+        sheet_order = []
+        sheet_values = {}  # nome da planilha -> lista de linhas (listas de valores)
+        try:
+            from python_calamine import CalamineWorkbook
+            cwb = CalamineWorkbook.from_path(excel_path)
+            for sheet_name in cwb.sheet_names:
+                rows = cwb.get_sheet_by_name(sheet_name).to_python()
+                sheet_values[sheet_name] = [list(row[:20]) for row in rows[:1000]]
+                sheet_order.append(sheet_name)
+            debug_log("Valores das planilhas lidos com python-calamine")
+        except ImportError:
+            import openpyxl
+            debug_log("python-calamine não disponível, usando openpyxl")
+            wb = openpyxl.load_workbook(excel_path, data_only=True, read_only=True)
+            for sheet in wb:
+                max_row = min(sheet.max_row or 0, 1000)
+                max_col = min(sheet.max_column or 0, 20)
+                rows = []
+                if max_row and max_col:
+                    for row in sheet.iter_rows(min_row=1, max_row=max_row,
+                                               max_col=max_col, values_only=True):
+                        rows.append(list(row))
+                sheet_values[sheet.title] = rows
+                sheet_order.append(sheet.title)
+            wb.close()
+
+        def cell_value_at(rows, row, col):
+            """Valor da célula (1-indexado) na tabela de valores, ou None."""
+            if 1 <= row <= len(rows):
+                row_vals = rows[row - 1]
+                if 1 <= col <= len(row_vals):
+                    return row_vals[col - 1]
+            return None
+
         # Mapear possíveis colunas de código
         code_columns = []
-        
+
         # Verificar especificamente a coluna F (6) que é conhecida como coluna de código
         code_columns.append(6)  # Coluna F é a 6ª coluna (0-indexed seria 5)
-        
+
         # Também verificar o cabeçalho para outras colunas potenciais de código
         code_headers = ['código', 'code', 'cod', 'codigo', 'referência', 'referencia', 'ref']
-        
-        for col in range(1, min(first_sheet.max_column + 1, 20)):  # Limitar a 20 colunas
-            header_value = first_sheet.cell(row=1, column=col).value
+
+        first_rows = sheet_values[sheet_order[0]] if sheet_order else []
+        headers = first_rows[0] if first_rows else []
+        for col, header_value in enumerate(headers[:19], start=1):  # Limitar a 20 colunas
             if header_value:
                 header_text = str(header_value).lower().strip()
                 for code_header in code_headers:
@@ -329,10 +423,11 @@ def associate_images_with_products(excel_path, images, output_dir):
             }
             
             # Método 1: Verificar se o nome da imagem contém um código da planilha
-            for sheet in wb:
+            for sheet_name in sheet_order:
+                rows = sheet_values[sheet_name]
                 for code_col in code_columns:
-                    for row in range(2, min(sheet.max_row + 1, 1000)):  # Limitar a 1000 linhas
-                        cell_value = sheet.cell(row=row, column=code_col).value
+                    for row in range(2, len(rows) + 1):  # Tabela já limitada a 1000 linhas
+                        cell_value = cell_value_at(rows, row, code_col)
                         if cell_value:
                             code = str(cell_value).strip()
                             
@@ -358,26 +453,23 @@ def associate_images_with_products(excel_path, images, output_dir):
             if not image_association["codigo"] and "cell" in image and "sheet" in image:
                 cell_ref = image["cell"]
                 sheet_name = image["sheet"]
-                
-                if sheet_name in wb.sheetnames:
-                    sheet = wb[sheet_name]
-                    
-                    # Extrair linha e coluna da referência de célula
-                    from openpyxl.utils import column_index_from_string
-                    
+
+                if sheet_name in sheet_values:
+                    rows = sheet_values[sheet_name]
+
                     match = re.match(r'([A-Z]+)(\d+)', cell_ref)
                     if match:
                         col_letter, row_num = match.groups()
                         row = int(row_num)
-                        
+
                         # Verificar células próximas para códigos de produto
                         for r_offset in range(-3, 4):  # -3 a +3 linhas
                             check_row = row + r_offset
-                            if check_row < 1 or check_row > sheet.max_row:
+                            if check_row < 1 or check_row > len(rows):
                                 continue
-                                
+
                             for code_col in code_columns:
-                                cell_value = sheet.cell(row=check_row, column=code_col).value
+                                cell_value = cell_value_at(rows, check_row, code_col)
                                 if cell_value:
                                     code = str(cell_value).strip()
                                     if code:
@@ -395,15 +487,14 @@ def associate_images_with_products(excel_path, images, output_dir):
                 img_index = image.get("index", 0)
                 
                 # Tentar associar com produtos na mesma ordem
-                sheets = list(wb)
-                if sheets:
-                    sheet = sheets[0]  # Usar primeira planilha
-                    
+                if sheet_order:
+                    rows = sheet_values[sheet_order[0]]  # Usar primeira planilha
+
                     # Pular o cabeçalho e começar do índice + 2
-                    row = min(img_index + 2, sheet.max_row)
-                    
+                    row = min(img_index + 2, len(rows))
+
                     for code_col in code_columns:
-                        cell_value = sheet.cell(row=row, column=code_col).value
+                        cell_value = cell_value_at(rows, row, code_col)
                         if cell_value:
                             code = str(cell_value).strip()
                             if code:
@@ -434,7 +525,7 @@ def associate_images_with_products(excel_path, images, output_dir):
         debug_log(f"Erro ao associar imagens: {str(e)}")
     
     # Retornar o resultado como JSON
-    print(json.dumps(result))
+    print_json(result)
     return result
 
 if __name__ == "__main__":
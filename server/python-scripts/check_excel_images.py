@@ -1,29 +1,24 @@
 
-import openpyxl
+import zipfile
 import sys
 import json
-import re
+
+# Extensões de imagem reconhecidas dentro de xl/media/
+IMG_EXTS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.emf', '.wmf')
 
 def check_excel_images(excel_file_path):
-    # Abrir o arquivo Excel
+    # Um XLSX é um ZIP: basta listar o diretório central (poucos KB no final
+    # do arquivo) e contar as entradas em xl/media/, sem carregar o workbook
+    # inteiro com openpyxl só para contar imagens
     try:
-        wb = openpyxl.load_workbook(excel_file_path)
-        
-        # Verificar cada planilha por imagens
-        has_images = False
-        total_images = 0
-        
-        for sheet_name in wb.sheetnames:
-            sheet = wb[sheet_name]
-            # Verificar se a planilha contém imagens
-            if hasattr(sheet, '_images') and len(sheet._images) > 0:
-                has_images = True
-                total_images += len(sheet._images)
-        
+        with zipfile.ZipFile(excel_file_path) as excel_zip:
+            media = [n for n in excel_zip.namelist()
+                     if n.startswith('xl/media/') and n.lower().endswith(IMG_EXTS)]
+
         # Retornar resultado como JSON
         print(json.dumps({
-            "has_images": has_images,
-            "total_images": total_images
+            "has_images": len(media) > 0,
+            "total_images": len(media)
         }))
     except Exception as e:
         print(json.dumps({
@@ -35,6 +30,6 @@ if __name__ == "__main__":
     if len(sys.argv) != 2:
         print(json.dumps({"error": "Argumentos inválidos! Uso: python script.py arquivo_excel.xlsx"}))
         sys.exit(1)
-    
+
     excel_file_path = sys.argv[1]
     check_excel_images(excel_file_path)
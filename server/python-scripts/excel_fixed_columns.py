@@ -5,12 +5,84 @@ import openpyxl
 import os
 import sys
 import json
-import base64
+import concurrent.futures
+import functools
 import re  # Importação explícita para uso em todo o módulo
+import struct
+import time
 import traceback  # Para capturar stack traces
+import zipfile
 from PIL import Image
 import io
 
+try:
+    import orjson  # Serializador JSON nativo, muito mais rápido para payloads grandes
+except ImportError:
+    orjson = None
+
+# Pré-compilados uma vez no carregamento do módulo: format_price roda uma vez
+# por linha, então evitar re.compile e múltiplos str.replace no caminho quente
+_PRICE_CLEAN = str.maketrans('', '', 'R$ ')
+_PRICE_EXTRACT = re.compile(r'[\d.,]+')
+_BR_SWAP = str.maketrans({',': '.', '.': ','})
+_SAFE_CODIGO_RE = re.compile(r'[^\w\-.]')
+
+# Logs de debug por linha/imagem custam um write() bloqueante no stderr cada;
+# em planilhas grandes isso domina o tempo. Ativar com EXCEL_DEBUG=1.
+DEBUG = bool(os.environ.get("EXCEL_DEBUG"))
+
+# Quantas linhas totalmente vazias seguidas encerram a leitura da planilha:
+# muitos geradores declaram uma dimensão com milhares de linhas vazias no
+# final, que seriam iteradas e filtradas uma a uma
+_MAX_EMPTY_RUN = 200
+
+def print_json(result):
+    """Escreve o resultado como JSON no stdout.
+
+    Com orjson os bytes vão direto para o buffer do stdout, sem construir a
+    string intermediária do json.dumps (relevante com milhares de produtos).
+    """
+    if orjson is not None:
+        sys.stdout.buffer.write(orjson.dumps(result))
+        sys.stdout.buffer.write(b'\n')
+        sys.stdout.buffer.flush()
+    else:
+        print(json.dumps(result))
+
+def quick_size(image_data):
+    """
+    Lê largura/altura direto do cabeçalho (PNG/JPEG) sem decodificar a imagem.
+
+    O filtro de imagens pequenas só precisa das dimensões; decodificar fotos
+    de produto inteiras via PIL só para isso custa dezenas de ms por imagem.
+    Retorna (largura, altura) ou None para formatos não reconhecidos.
+    """
+    # PNG: dimensões nos bytes 16-24 do chunk IHDR
+    if image_data[:8] == b'\x89PNG\r\n\x1a\n' and len(image_data) >= 24:
+        return struct.unpack('>II', image_data[16:24])
+
+    # JPEG: caminhar pelos marcadores até um SOFn (C0-CF, exceto C4/C8/CC)
+    if image_data[:2] == b'\xff\xd8':
+        pos = 2
+        size = len(image_data)
+        while pos + 9 < size:
+            if image_data[pos] != 0xFF:
+                pos += 1
+                continue
+            marker = image_data[pos + 1]
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack('>HH', image_data[pos + 5:pos + 9])
+                return (width, height)
+            seg_len = struct.unpack('>H', image_data[pos + 2:pos + 4])[0]
+            pos += 2 + seg_len
+        return None
+
+    return None
+
+def _clean_text(value):
+    """Normaliza valor de célula: strip em strings, demais tipos intactos."""
+    return value.strip() if type(value) is str else value
+
 def extract_products_fixed_columns(excel_file_path, output_dir):
     """
     Extrai produtos do Excel usando um mapeamento fixo de colunas:
@@ -24,8 +96,10 @@ def extract_products_fixed_columns(excel_file_path, output_dir):
     
     Também extrai imagens associadas e retorna a estrutura de dados completa.
     """
-    # Abrir o arquivo Excel
-    wb = openpyxl.load_workbook(excel_file_path, data_only=True)
+    # Abrir o arquivo Excel em modo read_only (streaming): evita materializar
+    # o DOM XML completo e um objeto Cell por célula, que explode a memória
+    # em arquivos grandes. As imagens são extraídas à parte, direto do ZIP.
+    wb = openpyxl.load_workbook(excel_file_path, read_only=True, data_only=True, keep_links=False)
     
     # Resultado para JSON
     result = {
@@ -39,32 +113,77 @@ def extract_products_fixed_columns(excel_file_path, output_dir):
         os.makedirs(output_dir)
     
     try:
-        # Para cada planilha no arquivo
-        for sheet_name in wb.sheetnames:
-            sheet = wb[sheet_name]
-            
-            # Extrair produtos da planilha
-            try:
-                row_products = extract_products_from_sheet(sheet)
-                result["products"].extend(row_products)
-                
-                # Extrair imagens da planilha
-                sheet_images = extract_images_from_sheet(sheet, output_dir)
-                result["images"].extend(sheet_images)
-                
-                # Associar imagens com produtos por código
-                associate_images_with_products(result["products"], result["images"])
-                
-            except Exception as e:
-                result["errors"].append(f"Erro ao processar planilha {sheet_name}: {str(e)}")
-    
+        # Com várias planilhas, a extração de produtos é independente por
+        # planilha e CPU-bound no parse XML do openpyxl — paralelizar por
+        # processos; com uma só, o custo do fork/pickle não se paga.
+        sheet_names = wb.sheetnames
+        if len(sheet_names) > 1:
+            max_workers = min(len(sheet_names), os.cpu_count() or 1)
+            with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = {name: executor.submit(_extract_sheet_products, excel_file_path, name)
+                           for name in sheet_names}
+                # Coletar na ordem original das planilhas
+                for sheet_name in sheet_names:
+                    try:
+                        result["products"].extend(futures[sheet_name].result())
+                    except Exception as e:
+                        result["errors"].append(f"Erro ao processar planilha {sheet_name}: {str(e)}")
+        else:
+            for sheet_name in sheet_names:
+                sheet = wb[sheet_name]
+
+                # Dimensão declarada pode ser lixo (ex.: "A1:A1"); nesse caso
+                # deixar o openpyxl recalcular a extensão real linha a linha
+                if sheet.calculate_dimension() == "A1:A1":
+                    sheet.reset_dimensions()
+
+                # Extrair produtos da planilha
+                try:
+                    row_products = extract_products_from_sheet(sheet)
+                    result["products"].extend(row_products)
+
+                except Exception as e:
+                    result["errors"].append(f"Erro ao processar planilha {sheet_name}: {str(e)}")
+
+        # Extrair imagens uma única vez, direto do ZIP do .xlsx (o arquivo de
+        # entrada já é um ZIP; não há por que reabrir via openpyxl). Os códigos
+        # são atribuídos pela linha da âncora usando os produtos já lidos.
+        try:
+            codes_by_row = {p["row"]: p["codigo"] for p in result["products"]}
+            result["images"] = extract_images_via_zip(excel_file_path, output_dir, codes_by_row)
+        except Exception as e:
+            result["errors"].append(f"Erro ao extrair imagens do ZIP: {str(e)}")
+
+        # Associar imagens com produtos por código — uma única vez, depois de
+        # todas as planilhas (chamar dentro do loop re-varria todos os
+        # produtos/imagens acumulados a cada planilha)
+        associate_images_with_products(result["products"], result["images"])
+
     except Exception as e:
         result["errors"].append(f"Erro geral ao processar arquivo Excel: {str(e)}")
-    
+    finally:
+        wb.close()
+
     # Retornar resultado como JSON
-    print(json.dumps(result))
+    print_json(result)
     return result
 
+def _extract_sheet_products(excel_file_path, sheet_name):
+    """
+    Extrai os produtos de uma planilha em um processo worker.
+
+    Reabre o arquivo em modo read_only no próprio processo: handles do
+    openpyxl não atravessam o pickle do ProcessPoolExecutor.
+    """
+    wb = openpyxl.load_workbook(excel_file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = wb[sheet_name]
+        if sheet.calculate_dimension() == "A1:A1":
+            sheet.reset_dimensions()
+        return extract_products_from_sheet(sheet)
+    finally:
+        wb.close()
+
 def extract_products_from_sheet(sheet):
     """
     Extrai produtos da planilha com mapeamento fixo de colunas:
@@ -77,50 +196,46 @@ def extract_products_from_sheet(sheet):
     L (12): valor total (preço do produto)
     """
     products = []
+    empty_run = 0
     print(f"Lendo produtos da planilha com {sheet.max_row} linhas...", file=sys.stderr)
-    
-    # Começar da linha 2 (pular cabeçalho)
-    for row_idx in range(2, sheet.max_row + 1):
+
+    # Começar da linha 2 (pular cabeçalho). iter_rows(values_only=True) faz
+    # uma única travessia em streaming, sem alocar um objeto Cell por coluna.
+    for row_idx, row in enumerate(sheet.iter_rows(min_row=2, max_col=12, values_only=True), start=2):
+        # Encerrar cedo quando a dimensão declarada passa muito do fim real
+        # dos dados (sequência longa de linhas 100% vazias)
+        if not any(row):
+            empty_run += 1
+            if empty_run >= _MAX_EMPTY_RUN:
+                print(f"Encerrando leitura na linha {row_idx}: {_MAX_EMPTY_RUN} linhas vazias seguidas", file=sys.stderr)
+                break
+            continue
+        empty_run = 0
+
         try:
-            # Ler valores das colunas específicas
-            nome_cell = sheet.cell(row=row_idx, column=1)  # Coluna A (1): nome
-            local_cell = sheet.cell(row=row_idx, column=2)  # Coluna B (2): local
-            fornecedor_cell = sheet.cell(row=row_idx, column=3)  # Coluna C (3): fornecedor
-            codigo_cell = sheet.cell(row=row_idx, column=6)  # Coluna F (6): código
-            descricao_cell = sheet.cell(row=row_idx, column=7)  # Coluna G (7): descrição
-            preco_cell = sheet.cell(row=row_idx, column=12)  # Coluna L (12): valor total
-            
-            # Obter valores das células
-            nome = nome_cell.value if nome_cell else None
-            local = local_cell.value if local_cell else None
-            fornecedor = fornecedor_cell.value if fornecedor_cell else None
-            codigo = codigo_cell.value if codigo_cell else None
-            descricao = descricao_cell.value if descricao_cell else None
-            preco = preco_cell.value if preco_cell else None
-            
-            # Limpar e normalizar valores (remover espaços extras, etc.)
-            if nome and isinstance(nome, str):
-                nome = nome.strip()
-            if local and isinstance(local, str):
-                local = local.strip()
-            if fornecedor and isinstance(fornecedor, str):
-                fornecedor = fornecedor.strip()
-            if codigo and isinstance(codigo, str):
-                codigo = codigo.strip()
-            elif codigo:
+            # Valores das colunas específicas (tupla 0-indexada), já
+            # normalizados por um único helper em vez de uma cascata de
+            # isinstance + strip por campo:
+            nome = _clean_text(row[0])        # Coluna A (1): nome
+            local = _clean_text(row[1])       # Coluna B (2): local
+            fornecedor = _clean_text(row[2])  # Coluna C (3): fornecedor
+            codigo = _clean_text(row[5])      # Coluna F (6): código
+            descricao = _clean_text(row[6])   # Coluna G (7): descrição
+            preco = row[11]                   # Coluna L (12): valor total
+
+            # Código pode vir numérico da planilha
+            if codigo and type(codigo) is not str:
                 codigo = str(codigo)
-            if descricao and isinstance(descricao, str):
-                descricao = descricao.strip()
-            
+
             # Debug: imprimir valores lidos
-            if row_idx < 10 or row_idx % 50 == 0:  # Limitar log
+            if DEBUG and (row_idx < 10 or row_idx % 50 == 0):  # Limitar log
                 print(f"Linha {row_idx}: nome='{nome}', codigo='{codigo}', preco='{preco}'", file=sys.stderr)
             
             # Pular linhas vazias ou com nome/código vazios ou inválidos
             if (not nome or nome == "_EMPTY_" or nome == "" or 
                 not codigo or codigo == "_EMPTY_" or codigo == "" or 
                 codigo == "UNKNOWN-CODE"):
-                if row_idx < 10 or row_idx % 50 == 0:  # Limitar log
+                if DEBUG and (row_idx < 10 or row_idx % 50 == 0):  # Limitar log
                     print(f"  -> Pulando linha {row_idx} (nome ou código inválido)", file=sys.stderr)
                 continue
             
@@ -151,17 +266,23 @@ def format_price(price_value):
     """
     if not price_value:
         return "R$ 0,00"
-    
+
+    # Caminho rápido: células numéricas (o caso comum em openpyxl com
+    # data_only=True) não precisam de limpeza de string nenhuma
+    if type(price_value) is float or type(price_value) is int:
+        return f"R$ {price_value:,.2f}".translate(_BR_SWAP)
+
+    # Catálogos repetem muito os mesmos preços; memoizar o parse de string
+    # transforma repetições em um lookup de dicionário
+    return _format_price_str(str(price_value))
+
+@functools.lru_cache(maxsize=4096)
+def _format_price_str(price_str):
+    """Faz o parse e a formatação de um preço recebido como string."""
     try:
-        # Debug - imprimir o valor e tipo recebido
-        print(f"Formatando preço: valor={price_value}, tipo={type(price_value)}", file=sys.stderr)
-        
-        # Converter para string se for outro tipo
-        price_str = str(price_value)
-        
-        # Limpar a string de qualquer formatação existente
-        # Remover R$, espaços e outros caracteres não essenciais
-        cleaned_value = price_str.replace("R$", "").replace(" ", "").strip()
+        # Limpar a string de qualquer formatação existente: um único translate
+        # remove "R$" e espaços em uma passada, sem strings intermediárias
+        cleaned_value = price_str.translate(_PRICE_CLEAN)
         
         # Verificar se é um número com formatação brasileira (1.234,56)
         if "," in cleaned_value and "." in cleaned_value:
@@ -176,9 +297,8 @@ def format_price(price_value):
             price_float = float(cleaned_value)
         except:
             # Se falhar, pode ser que esteja em notação científica ou outro formato
-            import re
-            # Extrair apenas dígitos e pontos/vírgulas
-            nums = re.findall(r'[\d.,]+', cleaned_value)
+            # Extrair apenas dígitos e pontos/vírgulas (regex pré-compilado)
+            nums = _PRICE_EXTRACT.findall(cleaned_value)
             if nums:
                 # Pegar o primeiro número encontrado
                 num_str = nums[0].replace(",", ".")
@@ -187,321 +307,202 @@ def format_price(price_value):
                 # Se não encontrou números, usar 0
                 price_float = 0.0
         
-        # Formatar como R$ XX.XXX,XX (formato brasileiro)
-        formatted_price = f"R$ {price_float:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-        
-        print(f"Preço formatado: {formatted_price}", file=sys.stderr)
+        # Formatar como R$ XX.XXX,XX (formato brasileiro): a troca . <-> ,
+        # é feita em uma única passada com translate, sem o "X" intermediário
+        formatted_price = f"R$ {price_float:,.2f}".translate(_BR_SWAP)
+
         return formatted_price
-    
+
     except (ValueError, TypeError) as e:
         # Em caso de erro, registrar e retornar um valor padrão formatado
-        print(f"Erro ao formatar preço '{price_value}': {str(e)}", file=sys.stderr)
-        return f"R$ {price_value}"
+        print(f"Erro ao formatar preço '{price_str}': {str(e)}", file=sys.stderr)
+        return f"R$ {price_str}"
 
-def extract_images_from_sheet(sheet, output_dir):
+def extract_images_via_zip(excel_file_path, output_dir, codes_by_row=None):
     """
-    Extrai imagens da planilha utilizando um método mais robusto.
+    Extrai as imagens embutidas direto do ZIP do .xlsx, sem openpyxl.
+
+    Lê xl/drawings/_rels/*.rels para mapear rId -> arquivo de mídia e
+    xl/drawings/drawing*.xml para recuperar a linha/coluna da âncora de cada
+    imagem; os bytes vêm de uma única leitura de xl/media/*. Não há
+    load_workbook nem wb.save: o arquivo de entrada já é o próprio ZIP.
+
+    codes_by_row permite atribuir o código do produto (coluna F) pela linha
+    da âncora, a partir dos produtos já extraídos.
     """
+    import xml.etree.ElementTree as ET
+
     images = []
-    
-    # Verificar se há imagens na planilha de diferentes formas
+    codes_by_row = codes_by_row or {}
+    run_ts = int(time.time())  # Token de unicidade desta execução, calculado uma vez
+
+    NS = {
+        'xdr': 'http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing',
+        'a': 'http://schemas.openxmlformats.org/drawingml/2006/main',
+        'rel': 'http://schemas.openxmlformats.org/package/2006/relationships',
+    }
+    R_EMBED = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed'
+
     try:
-        # Método 1: Tentar acessar pelas imagens embutidas se disponível
-        sheet_images = []
-        
-        # Tentar diferentes atributos para acessar imagens em diferentes versões do openpyxl
-        image_attributes = ['_images', 'images', '_drawings', 'drawings']
-        for attr in image_attributes:
-            if hasattr(sheet, attr):
-                try:
-                    images_attr = getattr(sheet, attr)
-                    if images_attr:
-                        print(f"Encontrado atributo de imagens: {attr} com {len(images_attr)} imagens", file=sys.stderr)
-                        sheet_images = images_attr
-                        break
-                except Exception as attr_err:
-                    print(f"Erro ao acessar {attr}: {attr_err}", file=sys.stderr)
-                    continue
-        
-        # Se não encontramos imagens, tentar métodos alternativos
-        if not sheet_images:
-            # Tentar acessar _drawing se disponível (em algumas versões do openpyxl)
-            if hasattr(sheet, '_drawing') and sheet._drawing:
+        with zipfile.ZipFile(excel_file_path, 'r') as zip_ref:
+            names = zip_ref.namelist()
+            media_files = [n for n in names if n.startswith('xl/media/')]
+            drawing_files = [n for n in names
+                             if n.startswith('xl/drawings/') and n.endswith('.xml')]
+
+            # Recuperar as âncoras (linha/coluna) de cada imagem nos drawings
+            anchors = []  # (row, col, caminho da mídia no ZIP)
+            for drawing in drawing_files:
+                # rId -> caminho da mídia, via arquivo de relações do drawing
+                rels_name = 'xl/drawings/_rels/' + os.path.basename(drawing) + '.rels'
+                rid_to_media = {}
+                if rels_name in names:
+                    try:
+                        rels_root = ET.fromstring(zip_ref.read(rels_name))
+                        for relationship in rels_root.findall('rel:Relationship', NS):
+                            target = relationship.get('Target') or ''
+                            if target.startswith('/'):
+                                # Alvo absoluto dentro do pacote (ex.: /xl/media/...)
+                                media_name = target.lstrip('/')
+                            else:
+                                # Alvo relativo ao diretório do drawing (ex.: ../media/...)
+                                media_name = os.path.normpath(
+                                    os.path.join('xl/drawings', target)).replace('\\', '/')
+                            rid_to_media[relationship.get('Id')] = media_name
+                    except Exception as rels_err:
+                        print(f"Erro ao ler relações de {drawing}: {rels_err}", file=sys.stderr)
+
                 try:
-                    drawing_images = getattr(sheet._drawing, 'images', []) or []
-                    if drawing_images:
-                        print(f"Encontradas {len(drawing_images)} imagens via _drawing.images", file=sys.stderr)
-                        sheet_images = drawing_images
+                    root = ET.fromstring(zip_ref.read(drawing))
                 except Exception as drawing_err:
-                    print(f"Erro ao acessar _drawing.images: {drawing_err}", file=sys.stderr)
-        
-        # Processar as imagens encontradas
-        total_saved = 0
-        print(f"Processando {len(sheet_images)} imagens encontradas na planilha", file=sys.stderr)
-        
-        for image_idx, image_tuple in enumerate(sheet_images):
-            try:
-                print(f"Processando imagem {image_idx}...", file=sys.stderr)
-                
-                # Gerar nome temporário para a imagem
-                temp_image_name = f"temp_image_{image_idx}.png"
-                temp_image_path = os.path.join(output_dir, temp_image_name)
-                
-                # Tentar diferentes formas de obter os dados da imagem
-                image_data = None
-                
-                # Lista de atributos possíveis que podem conter dados binários da imagem
-                binary_data_attrs = ['_data', 'data', 'blob', '_blob', 'content', '_content', 'image_data']
-                
-                # Tentar cada um dos atributos
-                for attr in binary_data_attrs:
-                    if hasattr(image_tuple, attr):
-                        try:
-                            data = getattr(image_tuple, attr)
-                            if isinstance(data, bytes) and len(data) > 100:  # Pelo menos 100 bytes
-                                image_data = data
-                                print(f"Dados binários encontrados no atributo: {attr}", file=sys.stderr)
-                                break
-                        except Exception as bin_err:
-                            print(f"Erro ao acessar {attr}: {bin_err}", file=sys.stderr)
-                            continue
-                
-                # Se não encontrou pelos atributos diretos, tentar por ref/blob
-                if not image_data and hasattr(image_tuple, 'ref') and hasattr(image_tuple.ref, 'blob'):
-                    try:
-                        blob_data = image_tuple.ref.blob
-                        if isinstance(blob_data, bytes) and len(blob_data) > 100:
-                            image_data = blob_data
-                            print(f"Dados binários encontrados via ref.blob", file=sys.stderr)
-                    except Exception as ref_err:
-                        print(f"Erro ao acessar ref.blob: {ref_err}", file=sys.stderr)
-                
-                # Verificar se temos dados válidos
-                if not image_data or not isinstance(image_data, bytes) or len(image_data) < 100:
-                    print(f"Dados da imagem {image_idx} inválidos ou muito pequenos", file=sys.stderr)
-                    # Continuar para a próxima imagem
+                    print(f"Erro ao ler drawing {drawing}: {drawing_err}", file=sys.stderr)
                     continue
-                
-                # Salvar imagem em disco temporariamente
-                with open(temp_image_path, "wb") as f:
-                    f.write(image_data)
-                
-                # Obter informação da linha onde a imagem está
-                row = 0
-                col = 0
-                
-                # Tentar diferentes formas de obter as coordenadas da imagem
-                try:
-                    # Opção 1: pelo objeto anchor (tipo comum)
-                    if hasattr(image_tuple, 'anchor'):
-                        anchor = image_tuple.anchor
-                        if hasattr(anchor, 'to'):
-                            if hasattr(anchor.to, 'row'):
-                                row = anchor.to.row
-                            if hasattr(anchor.to, 'col'):
-                                col = anchor.to.col
-                        elif hasattr(anchor, 'row'):
-                            row = anchor.row
-                        elif hasattr(anchor, 'col'):
-                            col = anchor.col
-                    # Opção 2: pelas próprias propriedades
-                    elif hasattr(image_tuple, 'row'):
-                        row = image_tuple.row
-                    elif hasattr(image_tuple, 'col'):
-                        col = image_tuple.col
-                except Exception as coord_err:
-                    print(f"Erro ao obter coordenadas: {coord_err}", file=sys.stderr)
-                
-                print(f"Coordenadas da imagem {image_idx}: linha={row}, coluna={col}", file=sys.stderr)
-                
-                # Determinar o código do produto para esta imagem
-                codigo = None
-                
-                # Estratégia 1: Se temos a linha, usar prioritariamente o código na coluna F (6)
-                if row > 0:
-                    # Verificar na mesma linha
-                    codigo_cell = sheet.cell(row=row, column=6).value
-                    if codigo_cell and str(codigo_cell).strip():
-                        codigo = str(codigo_cell).strip()
-                        print(f"Código encontrado na mesma linha {row}: {codigo}", file=sys.stderr)
-                
-                # Estratégia 2: Procurar pelas linhas próximas (3 linhas acima e abaixo)
-                if not codigo and row > 0:
-                    for r in range(max(1, row-3), min(sheet.max_row, row+3)):
-                        codigo_cell = sheet.cell(row=r, column=6).value
-                        if codigo_cell and str(codigo_cell).strip():
-                            codigo = str(codigo_cell).strip()
-                            print(f"Código encontrado em linha próxima {r}: {codigo}", file=sys.stderr)
-                            break
-                
-                # Estratégia 3: Se a imagem estiver na coluna D (4), buscar código na mesma linha
-                if not codigo and col == 4:
-                    # Verificar se esta linha tem um código válido
-                    codigo_cell = sheet.cell(row=row, column=6).value
-                    if codigo_cell and str(codigo_cell).strip():
-                        codigo = str(codigo_cell).strip()
-                        print(f"Código encontrado para imagem na coluna D: {codigo}", file=sys.stderr)
-                
-                # Estratégia 4: Buscar todas as ocorrências de imagens na coluna D (4)
-                if not codigo:
-                    for r in range(2, sheet.max_row + 1):  # Começar da linha 2
-                        # Se a célula na coluna D (4) não está vazia (possível local de imagem)
-                        try:
-                            cell_d = sheet.cell(row=r, column=4)
-                            if cell_d and (cell_d.value or abs(r - row) < 2):  # mesmo que sem valor, se próxima da nossa linha
-                                # Verificar se esta linha tem um código válido
-                                codigo_cell = sheet.cell(row=r, column=6).value
-                                if codigo_cell and str(codigo_cell).strip():
-                                    codigo = str(codigo_cell).strip()
-                                    print(f"Código encontrado na linha {r} com possível imagem: {codigo}", file=sys.stderr)
-                                    row = r  # Atualizar a linha para esta
-                                    break
-                        except Exception as cell_err:
-                            print(f"Erro ao verificar célula: {cell_err}", file=sys.stderr)
+
+                for anchor_tag in ('xdr:twoCellAnchor', 'xdr:oneCellAnchor'):
+                    for anchor in root.findall(anchor_tag, NS):
+                        from_el = anchor.find('xdr:from', NS)
+                        blip = anchor.find('.//a:blip', NS)
+                        if from_el is None or blip is None:
                             continue
-                
-                # Estratégia 5 (último recurso): Usar índice como identificador único
-                if not codigo:
-                    # Criar código baseado em índice, linha, coluna e timestamp para garantir exclusividade
-                    import time
-                    timestamp = int(time.time())
-                    codigo = f"imagem_idx{image_idx}_r{row}_c{col}_{timestamp}"
-                    print(f"Sem código identificado, usando identificador único: {codigo}", file=sys.stderr)
-                
-                # Remover caracteres inválidos do código para uso como nome de arquivo
-                safe_codigo = re.sub(r'[^\w\-\.]', '_', codigo)
-                
-                # Adicionar o índice da imagem ao código para garantir exclusividade
-                safe_codigo = f"{safe_codigo}_{image_idx}"
-                
-                # Definir nome e caminho final da imagem
-                image_filename = f"{safe_codigo}.png"
-                image_path = os.path.join(output_dir, image_filename)
-                
-                # Se já existe arquivo com esse nome, adicionar sufixo
-                suffix = 1
-                while os.path.exists(image_path):
-                    image_filename = f"{safe_codigo}_{suffix}.png"
-                    image_path = os.path.join(output_dir, image_filename)
-                    suffix += 1
-                
-                # Verificar se a imagem é válida e tem um tamanho razoável
+                        row_el = from_el.find('xdr:row', NS)
+                        col_el = from_el.find('xdr:col', NS)
+                        row = int(row_el.text) + 1 if row_el is not None else 0
+                        col = int(col_el.text) + 1 if col_el is not None else 0
+                        media_name = rid_to_media.get(blip.get(R_EMBED))
+                        if media_name:
+                            anchors.append((row, col, media_name))
+
+            # Mídias sem âncora identificada entram no final, com linha 0
+            anchored_names = {m for _, _, m in anchors}
+            for media_name in media_files:
+                if media_name not in anchored_names:
+                    anchors.append((0, 0, media_name))
+
+            print(f"Processando {len(anchors)} imagens encontradas no ZIP", file=sys.stderr)
+
+            # Contador de nomes já usados nesta execução: detectar colisão com
+            # um incremento em dicionário, sem stat() por tentativa no disco
+            used_names = {}
+
+            # Abrir o diretório de saída uma vez: gravar via dir_fd evita a
+            # resolução completa do caminho a cada imagem
+            dir_fd = None
+            if hasattr(os, 'O_DIRECTORY') and os.open in os.supports_dir_fd:
+                try:
+                    dir_fd = os.open(output_dir, os.O_DIRECTORY)
+                except OSError:
+                    dir_fd = None
+
+            for image_idx, (row, col, media_name) in enumerate(anchors):
                 try:
-                    from PIL import Image
-                    img = Image.open(temp_image_path)
-                    width, height = img.size
-                    
-                    # Verificar dimensões - ignorar imagens muito pequenas (possíveis ícones/lixo)
-                    if width < 20 or height < 20:
-                        print(f"Imagem muito pequena ({width}x{height}), pulando...", file=sys.stderr)
-                        img.close()
-                        if os.path.exists(temp_image_path):
-                            os.remove(temp_image_path)
+                    image_data = zip_ref.read(media_name)
+
+                    # Verificar se temos dados válidos
+                    if len(image_data) < 100:
+                        print(f"Dados da imagem {image_idx} inválidos ou muito pequenos", file=sys.stderr)
                         continue
-                    
-                    # Fechar a imagem após verificação
-                    img.close()
-                except Exception as img_err:
-                    print(f"Erro ao verificar imagem: {img_err}", file=sys.stderr)
-                    # Continuar mesmo com erro, a imagem ainda pode ser válida
-                
-                # Copiar para o caminho final
-                import shutil
-                if os.path.exists(temp_image_path):
-                    shutil.copy2(temp_image_path, image_path)
-                    os.remove(temp_image_path)  # Remover temporário
-                
-                # Converter imagem para base64
-                with open(image_path, "rb") as image_file:
-                    encoded_image = base64.b64encode(image_file.read()).decode('utf-8')
-                
-                # Adicionar à lista de imagens
-                image_info = {
-                    "codigo": codigo,
-                    "filename": image_filename,
-                    "path": image_path,
-                    "base64": encoded_image,
-                    "row": row,  # Guardar a linha para associação
-                    "col": col   # Guardar a coluna também
-                }
-                
-                images.append(image_info)
-                total_saved += 1
-                print(f"Imagem {image_idx} processada com sucesso: {image_filename}", file=sys.stderr)
-                
-            except Exception as e:
-                print(f"Erro no script Python: Erro ao processar imagem {image_idx}: {str(e)}", file=sys.stderr)
-                print(f"Stack trace: {traceback.format_exc()}", file=sys.stderr)
-        
-        print(f"Total de imagens extraídas e salvas: {total_saved} de {len(sheet_images)}", file=sys.stderr)
-        
+
+                    # Verificar dimensões - ignorar imagens muito pequenas
+                    # (possíveis ícones/lixo). Primeiro pelo cabeçalho, sem
+                    # decodificar; PIL só entra para formatos não reconhecidos
+                    try:
+                        dims = quick_size(image_data)
+                        if dims is None:
+                            img = Image.open(io.BytesIO(image_data))
+                            dims = img.size
+                            img.close()
+                        width, height = dims
+                        if width < 20 or height < 20:
+                            print(f"Imagem muito pequena ({width}x{height}), pulando...", file=sys.stderr)
+                            continue
+                    except Exception as img_err:
+                        print(f"Erro ao verificar imagem: {img_err}", file=sys.stderr)
+                        # Continuar mesmo com erro, a imagem ainda pode ser válida
+
+                    # Determinar o código do produto pela linha da âncora.
+                    # Se a linha exata não tiver produto (âncora deslocada),
+                    # sondar as linhas vizinhas (±3) — cada sondagem é um
+                    # lookup O(1) no dicionário, sem varrer a planilha.
+                    codigo = codes_by_row.get(row)
+                    if not codigo and row > 0:
+                        for offset in (-1, 1, -2, 2, -3, 3):
+                            codigo = codes_by_row.get(row + offset)
+                            if codigo:
+                                break
+                    if codigo:
+                        if DEBUG:
+                            print(f"Código encontrado na linha {row}: {codigo}", file=sys.stderr)
+                    else:
+                        # Último recurso: identificador único por índice/posição
+                        codigo = f"imagem_idx{image_idx}_r{row}_c{col}_{run_ts}"
+                        print(f"Sem código identificado, usando identificador único: {codigo}", file=sys.stderr)
+
+                    # Remover caracteres inválidos do código para uso como nome de arquivo
+                    safe_codigo = _SAFE_CODIGO_RE.sub('_', codigo)
+
+                    # Adicionar o índice da imagem ao código para garantir exclusividade
+                    safe_codigo = f"{safe_codigo}_{image_idx}"
+
+                    # Definir nome e caminho final da imagem; em caso de
+                    # colisão, o sufixo vem do contador em memória
+                    n = used_names.get(safe_codigo, 0)
+                    used_names[safe_codigo] = n + 1
+                    image_filename = f"{safe_codigo}.png" if n == 0 else f"{safe_codigo}_{n}.png"
+                    image_path = os.path.join(output_dir, image_filename)
+
+                    # Gravar a imagem uma única vez, direto no caminho final
+                    # (relativo ao dir_fd quando suportado)
+                    if dir_fd is not None:
+                        fd = os.open(image_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644, dir_fd=dir_fd)
+                    else:
+                        fd = os.open(image_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                    try:
+                        os.write(fd, image_data)
+                    finally:
+                        os.close(fd)
+
+                    # Adicionar à lista de imagens (apenas o caminho em disco)
+                    images.append({
+                        "codigo": codigo,
+                        "filename": image_filename,
+                        "path": image_path,
+                        "row": row,  # Guardar a linha para associação
+                        "col": col   # Guardar a coluna também
+                    })
+                    if DEBUG:
+                        print(f"Imagem {image_idx} processada com sucesso: {image_filename}", file=sys.stderr)
+
+                except Exception as e:
+                    print(f"Erro no script Python: Erro ao processar imagem {image_idx}: {str(e)}", file=sys.stderr)
+                    print(f"Stack trace: {traceback.format_exc()}", file=sys.stderr)
+
+            if dir_fd is not None:
+                os.close(dir_fd)
+
     except Exception as e:
         print(f"Erro geral no script Python: {str(e)}", file=sys.stderr)
         print(f"Stack trace: {traceback.format_exc()}", file=sys.stderr)
-    
-    # Segundo método: usar PIL para procurar imagens (fallback)
-    if len(images) == 0:
-        try:
-            from PIL import Image as PILImage
-            import tempfile
-            
-            # Salvar o arquivo Excel como temporário com extensão .xlsx
-            temp_dir = tempfile.mkdtemp()
-            temp_excel = os.path.join(temp_dir, "temp.xlsx")
-            wb = openpyxl.load_workbook(filename=excel_file_path)
-            wb.save(temp_excel)
-            
-            # Usar a biblioteca zipfile para extrair imagens
-            import zipfile
-            
-            with zipfile.ZipFile(temp_excel, 'r') as zip_ref:
-                # Extrair todas as imagens do arquivo
-                image_files = [f for f in zip_ref.namelist() if f.startswith('xl/media/')]
-                
-                for idx, image_file in enumerate(image_files):
-                    try:
-                        # Extrair a imagem para um arquivo temporário
-                        img_temp = os.path.join(temp_dir, f"temp_img_{idx}.png")
-                        with open(img_temp, 'wb') as f:
-                            f.write(zip_ref.read(image_file))
-                        
-                        # Gerar nome único baseado no índice, timestamp e nome do arquivo original
-                        import time
-                        timestamp = int(time.time())
-                        original_name = os.path.basename(image_file)
-                        codigo = f"img_{idx}_{timestamp}_{original_name.replace('.', '_')}"
-                        
-                        # Garantir que o código seja único
-                        safe_codigo = re.sub(r'[^\w\-\.]', '_', codigo)
-                        image_filename = f"{safe_codigo}.png"
-                        image_path = os.path.join(output_dir, image_filename)
-                        
-                        # Copiar para o destino final
-                        import shutil
-                        shutil.copy2(img_temp, image_path)
-                        
-                        # Converter para base64
-                        with open(image_path, "rb") as image_file:
-                            encoded_image = base64.b64encode(image_file.read()).decode('utf-8')
-                        
-                        # Adicionar à lista
-                        images.append({
-                            "codigo": codigo,
-                            "filename": image_filename,
-                            "path": image_path,
-                            "base64": encoded_image
-                        })
-                        
-                    except Exception as e:
-                        print(f"Erro no script Python: Erro ao processar imagem zip {idx}: {str(e)}", file=sys.stderr)
-            
-            # Limpar arquivos temporários
-            import shutil
-            shutil.rmtree(temp_dir, ignore_errors=True)
-            
-        except Exception as e:
-            print(f"Erro no script Python: Erro no método fallback: {str(e)}", file=sys.stderr)
-    
+
     print(f"Total de {len(images)} imagens extraídas", file=sys.stderr)
     return images
 
@@ -510,84 +511,94 @@ def associate_images_with_products(products, images):
     Associa imagens aos produtos com base no código e na linha, garantindo uma associação 1:1 estrita.
     """
     print(f"Associando {len(images)} imagens a {len(products)} produtos...", file=sys.stderr)
-    
-    # Criar dicionário de imagens por código
+
+    # Índice único, montado uma vez: chaves de linha primeiro, chaves de
+    # código depois. A prioridade (código antes de linha) fica na ordem dos
+    # candidatos sondados por produto, não em cadeias de if por passagem.
     images_by_code = {}
+    combined = {}
     for img in images:
-        images_by_code[img["codigo"]] = img
-    
-    # Criar dicionário de imagens por linha
-    images_by_row = {}
+        if img.get("row", 0) > 0:
+            combined[f"__row{img['row']}"] = img
     for img in images:
-        if "row" in img and img["row"] > 0:
-            # Usar linha+coluna como chave única para garantir associação precisa
-            row_col_key = f"{img['row']}_{img.get('col', 0)}"
-            images_by_row[row_col_key] = img
-    
+        images_by_code[img["codigo"]] = img
+        combined[img["codigo"]] = img
+
     # Manter registro de imagens já utilizadas para evitar duplicação
     used_images = set()
-    
+
     # Número de produtos atualizados
     updated_products = 0
-    
-    # Primeira passagem: Associação exata por código
+
+    # Passagem única: sondagem O(1) por candidato, na ordem de prioridade
+    # (código exato, depois linha da âncora)
+    unmatched = []
     for product in products:
         codigo = product["codigo"]
-        # Associar pelo código exato apenas
-        if codigo in images_by_code and images_by_code[codigo]["codigo"] not in used_images:
-            product["imagem"] = f"data:image/png;base64,{images_by_code[codigo]['base64']}"
-            used_images.add(images_by_code[codigo]["codigo"])
+        hit = None
+        for key in (codigo, f"__row{product['row']}"):
+            img = combined.get(key)
+            if img is not None and img["codigo"] not in used_images:
+                hit = img
+                break
+
+        if hit is not None:
+            product["imagem"] = hit["path"]
+            used_images.add(hit["codigo"])
             updated_products += 1
-            print(f"[EXATO] Associada imagem ao produto '{product['nome']}' pelo código: {codigo}", file=sys.stderr)
+            if DEBUG:
+                print(f"[EXATO/LINHA] Associada imagem ao produto '{product['nome']}': {hit['codigo']}", file=sys.stderr)
             # Armazenar ID da imagem no produto para referência
-            product["image_id"] = images_by_code[codigo]["codigo"]
-    
-    # Segunda passagem: Associação por linha e coluna para produtos sem imagem
-    for product in products:
-        if "imagem" in product:
-            continue  # Já tem imagem da primeira passagem
-            
-        if "row" in product and product["row"] > 0:
-            # Gerar chave linha+coluna
-            row_col_key = f"{product['row']}_{product.get('col', 0)}"
-            
-            if row_col_key in images_by_row and images_by_row[row_col_key]["codigo"] not in used_images:
-                product["imagem"] = f"data:image/png;base64,{images_by_row[row_col_key]['base64']}"
-                used_images.add(images_by_row[row_col_key]["codigo"])
+            product["image_id"] = hit["codigo"]
+        else:
+            unmatched.append(product)
+
+    # Fallback por proximidade, só para produtos que ficaram sem imagem.
+    # Usar um critério mais estrito para evitar falsas associações.
+    # Em vez de varrer todos os pares produto x imagem testando `in` (O(N·M·L)),
+    # indexar uma vez todas as substrings (len >= 4) dos códigos de imagem e
+    # fazer O(L²) sondagens de dicionário por produto.
+    if unmatched:
+        MIN_SUB = 4
+        substring_index = {}  # substring -> lista de códigos de imagem que a contêm
+        img_code_rank = {img_code: rank for rank, img_code in enumerate(images_by_code)}
+        for img_code in images_by_code:
+            subs = {img_code}
+            for i in range(len(img_code)):
+                for j in range(i + MIN_SUB, len(img_code) + 1):
+                    subs.add(img_code[i:j])
+            for sub in subs:
+                substring_index.setdefault(sub, []).append(img_code)
+
+        for product in unmatched:
+            codigo = product["codigo"]
+
+            # Candidatos onde o código do produto está contido no código da imagem
+            candidates = set(substring_index.get(codigo, ()))
+            # ... e onde o código da imagem está contido no código do produto
+            for i in range(len(codigo)):
+                for j in range(i + 1, len(codigo) + 1):
+                    sub = codigo[i:j]
+                    if (len(sub) >= MIN_SUB or sub == codigo) and sub in images_by_code:
+                        candidates.add(sub)
+
+            closest_img = None
+            closest_img_codigo = None
+            for img_code in sorted(candidates, key=img_code_rank.get):
+                if img_code not in used_images:
+                    closest_img = images_by_code[img_code]
+                    closest_img_codigo = img_code
+                    break
+
+            if closest_img is not None:
+                product["imagem"] = closest_img["path"]
+                used_images.add(closest_img_codigo)
                 updated_products += 1
-                print(f"[LINHA] Associada imagem ao produto '{product['nome']}' pela linha/coluna: {row_col_key}", file=sys.stderr)
+                if DEBUG:
+                    print(f"[PARCIAL] Associada imagem ao produto '{product['nome']}': {codigo} ↔ {closest_img_codigo}", file=sys.stderr)
                 # Armazenar ID da imagem
-                product["image_id"] = images_by_row[row_col_key]["codigo"]
-    
-    # Terceira passagem: Associação por proximidade para produtos sem imagem
-    # Usar um critério mais estrito para evitar falsas associações
-    for product in products:
-        if "imagem" in product:
-            continue  # Já tem imagem
-            
-        codigo = product["codigo"]
-        closest_img = None
-        closest_img_codigo = None
-        
-        for img_code, img in images_by_code.items():
-            if img_code in used_images:
-                continue  # Imagem já usada
-                
-            # Associar apenas se o código do produto estiver contido na imagem ou vice-versa
-            # E aplicar comparação de proximidade para escolher a melhor
-            if codigo in img_code or img_code in codigo:
-                if closest_img is None:
-                    closest_img = img
-                    closest_img_codigo = img_code
-        
-        if closest_img is not None:
-            product["imagem"] = f"data:image/png;base64,{closest_img['base64']}"
-            used_images.add(closest_img_codigo)
-            updated_products += 1
-            print(f"[PARCIAL] Associada imagem ao produto '{product['nome']}': {codigo} ↔ {closest_img_codigo}", file=sys.stderr)
-            # Armazenar ID da imagem
-            product["image_id"] = closest_img_codigo
-    
+                product["image_id"] = closest_img_codigo
+
     print(f"Associadas imagens a {updated_products} de {len(products)} produtos ({updated_products/len(products)*100:.1f}%)", file=sys.stderr)
 
 if __name__ == "__main__":
@@ -1,137 +1,241 @@
 
-import openpyxl
 import os
 import sys
+import concurrent.futures
+import hashlib
+import io
 import json
-import base64
 import re
 
+try:
+    import pybase64 as _b64  # Codificador base64 vetorizado (AVX2), ~20x o stdlib
+except ImportError:
+    import base64 as _b64
+
+try:
+    import orjson
+    def _dumps(obj):
+        return orjson.dumps(obj)
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+def _b64_stream(data):
+    """Base64 em blocos de 48 KB (fronteira exata 3->4) via memoryview.
+
+    Evita materializar um segundo buffer do tamanho da imagem: cada bloco
+    codificado cabe em cache e vai direto para o StringIO.
+    """
+    mv = memoryview(data)
+    out = io.StringIO()
+    step = 48 * 1024
+    for i in range(0, len(mv), step):
+        out.write(_b64.b64encode(mv[i:i + step]).decode('ascii'))
+    return out.getvalue()
+import zipfile
+
+from xlsx_image_core import collect_anchors, image_format
+
+# Validador de código de produto: alfanumérico com pontos, 5+ caracteres —
+# o mesmo critério do antigo replace('.','').isalnum(), sem alocar string
+_CODE_RE = re.compile(r'^[A-Za-z0-9.]{5,}$')
+
+# Offsets da vizinhança 7x7 ordenados pela distância ao quadrado da âncora:
+# o primeiro match é o mais próximo da imagem, não o do canto superior
+# esquerdo da varredura em ordem de linha
+_OFFSETS = sorted(((r, c) for r in range(-3, 4) for c in range(-3, 4)),
+                  key=lambda rc: rc[0] * rc[0] + rc[1] * rc[1])
+
+# Sanitização de nomes de arquivo: tudo que não for [A-Za-z0-9._-] vira '_'.
+# Substitui a regex r'[^w.-]' que, sem a contrabarra, destruía os códigos.
+_SAFE_TRANS = str.maketrans(
+    {c: '_' for c in map(chr, range(128)) if not (c.isalnum() or c in '._-')})
+
+def _safe_name(product_code):
+    return str(product_code).encode('ascii', 'replace').decode().translate(_SAFE_TRANS)
+
+def _load_sheet_values(excel_file_path):
+    """
+    Carrega uma tabela de valores por planilha (limitada a 2000x20) para a
+    busca do código de produto perto da âncora, sem abrir o workbook inteiro
+    com openpyxl em modo normal.
+    """
+    tables = []
+    try:
+        from python_calamine import CalamineWorkbook
+        cwb = CalamineWorkbook.from_path(excel_file_path)
+        for sheet_name in cwb.sheet_names:
+            rows = cwb.get_sheet_by_name(sheet_name).to_python()
+            tables.append([list(row[:20]) for row in rows[:2000]])
+    except ImportError:
+        import openpyxl
+        wb = openpyxl.load_workbook(excel_file_path, read_only=True,
+                                    data_only=True, keep_links=False)
+        for sheet in wb:
+            max_row = min(sheet.max_row or 0, 2000)
+            max_col = min(sheet.max_column or 0, 20)
+            rows = []
+            if max_row and max_col:
+                for row in sheet.iter_rows(min_row=1, max_row=max_row,
+                                           max_col=max_col, values_only=True):
+                    rows.append(list(row))
+            tables.append(rows)
+        wb.close()
+    return tables
+
+def _cell_value(tables, row, col):
+    """Valor da célula (1-indexada) na primeira planilha que a tiver, ou None."""
+    if row < 1 or col < 1:
+        return None
+    for rows in tables:
+        if row <= len(rows):
+            row_vals = rows[row - 1]
+            if col <= len(row_vals):
+                value = row_vals[col - 1]
+                if value is not None and value != "":
+                    return value
+    return None
+
 def extract_images_from_excel(excel_file_path, output_dir):
-    wb = openpyxl.load_workbook(excel_file_path)
-    result = {"images": [], "error": None}
-    
+    # Saída em streaming: cada entrada vai para o stdout assim que o base64
+    # fica pronto, em vez de acumular result["images"] inteiro em memória
+    # (pico ~2x o total de base64) e serializar tudo no final.
+    out = sys.stdout.buffer
+    started = False
+    error = None
+
     try:
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
-            
-        image_counter = 0
-        for sheet_name in wb.sheetnames:
-            sheet = wb[sheet_name]
-            # Usar a forma oficial (embora possa ser lenta para alguns formatos) ou iterar por shapes
-            # Vamos tentar iterar pelas imagens diretamente no sheet, que é mais comum
-            if not hasattr(sheet, '_images'): continue
-            
-            print(f"Planilha '{sheet_name}' tem {len(sheet._images)} imagens.", file=sys.stderr)
-            
-            for image_obj in sheet._images:
+
+        # O .xlsx já é um ZIP: ler as mídias e âncoras direto dele evita o
+        # load_workbook completo (que materializa um objeto por célula) e a
+        # sondagem frágil de sheet._images. A tabela de valores limitada
+        # cobre a busca do código de produto perto da âncora.
+        tables = _load_sheet_values(excel_file_path)
+
+        with zipfile.ZipFile(excel_file_path, 'r') as zip_ref:
+            names = zip_ref.namelist()
+            anchors, unanchored = collect_anchors(zip_ref, names)
+            # Mídias sem âncora entram no final com (0, 0) para não se perderem
+            anchors += [(0, 0, media_name) for media_name in unanchored]
+            print(f"Encontradas {len(anchors)} imagens no arquivo.", file=sys.stderr)
+
+            # Primeira passada (serial, o ZIP não é thread-safe): bytes da
+            # imagem + código do produto por âncora
+            jobs = []
+            image_counter = 0
+            for row, col, media_name in anchors:
                 image_counter += 1
-                image_data = None
                 product_code = None
 
-                # --- Tentativa de Acesso aos Dados da Imagem ---
                 try:
-                    # Em versões mais recentes, a imagem pode ser acessada diretamente
-                    # O objeto openpyxl.drawing.image.Image tem um método _data() ou bytes diretamente?
-                    # A documentação não é clara sobre o acesso direto aos bytes.
-                    # O erro anterior sugere que _data pode ser um método.
-                    
-                    # Tentativa 1: Chamar _data() se for callable
-                    if hasattr(image_obj, '_data') and callable(image_obj._data):
-                        data_result = image_obj._data()
-                        if isinstance(data_result, bytes):
-                            image_data = data_result
-                        else:
-                             print(f"Aviso Img {image_counter}: image_obj._data() não retornou bytes.", file=sys.stderr)
-                    
-                    # Tentativa 2: Acessar _data diretamente se não for callable (e Tentativa 1 falhou)
-                    elif hasattr(image_obj, '_data') and isinstance(image_obj._data, bytes):
-                        image_data = image_obj._data
-
-                    # Tentativa 3: Usar o método ref (pode ser caminho interno)
-                    # Esta abordagem é mais complexa e menos garantida
-                    # if not image_data and hasattr(image_obj, 'ref'):
-                    #    print(f"Aviso Img {image_counter}: Tentando com image_obj.ref: {image_obj.ref}", file=sys.stderr)
-                         # Precisaria abrir o arquivo zip do Excel e ler a referência interna
-
-                    if not image_data:
-                         print(f"Falha Img {image_counter}: Não foi possível obter dados binários válidos.", file=sys.stderr)
-                         continue # Pula para a próxima imagem
-
+                    image_data = zip_ref.read(media_name)
                 except Exception as data_err:
                     print(f"Erro Img {image_counter}: Erro ao acessar dados da imagem: {data_err}", file=sys.stderr)
-                    continue # Pula para a próxima imagem
-                # --- Fim da Tentativa de Acesso ---
+                    continue
 
-                # Salvar temporariamente para converter (ainda necessário para base64)
-                temp_image_name = f"temp_img_{image_counter}.png"
-                temp_image_path = os.path.join(output_dir, temp_image_name)
-                try:
-                    with open(temp_image_path, "wb") as f:
-                        # AQUI é onde o erro acontecia. image_data DEVE ser bytes.
-                        if isinstance(image_data, bytes):
-                            f.write(image_data)
-                        else:
-                             raise TypeError(f"image_data não é bytes, é {type(image_data)}")
-                except Exception as write_err:
-                     print(f"Erro Img {image_counter}: Erro ao salvar temp {temp_image_name}: {write_err}", file=sys.stderr)
-                     continue 
-
-                # Encontrar código do produto próximo (lógica existente mantida)
+                # Encontrar código do produto próximo à âncora (vizinhança 7x7
+                # em espiral por proximidade, sondando a tabela em memória)
                 try:
-                    row = image_obj.anchor.to.row
-                    col = image_obj.anchor.to.col
-                    for r_offset in range(-3, 4):
-                        for c_offset in range(-3, 4):
-                             cell_row = max(1, row + r_offset)
-                             cell_col = max(1, col + c_offset)
-                             cell_value = sheet.cell(row=cell_row, column=cell_col).value
-                             if cell_value and isinstance(cell_value, str):
-                                 if cell_value.replace('.', '').isalnum() and len(cell_value) >= 5:
-                                      product_code = cell_value
-                                      break
-                        if product_code: break
+                    for r_offset, c_offset in _OFFSETS:
+                        cell_value = _cell_value(tables, row + r_offset, col + c_offset)
+                        if isinstance(cell_value, str) and _CODE_RE.match(cell_value):
+                            product_code = cell_value
+                            break
                 except Exception as anchor_err:
                     print(f"Erro Img {image_counter}: Erro ao obter âncora/código: {anchor_err}", file=sys.stderr)
-                
-                if not product_code: product_code = f"unknown_product_{image_counter}"
-                
-                # Converter para base64
-                encoded_image = None
-                try:
-                    with open(temp_image_path, "rb") as image_file:
-                         encoded_image = base64.b64encode(image_file.read()).decode('utf-8')
-                except Exception as b64_err:
-                    print(f"Erro Img {image_counter}: Erro ao converter para base64: {b64_err}", file=sys.stderr)
-                finally:
-                    # Garantir limpeza do arquivo temporário
-                    if os.path.exists(temp_image_path):
-                        try: os.remove(temp_image_path)
-                        except: pass
-                
-                if not encoded_image:
-                    continue # Pular se não conseguiu converter
-
-                # Gerar nome final seguro
-                safe_product_code = re.sub(r'[^w.-]', '_', str(product_code))
-                image_filename = f"{safe_product_code}.png"
-                
-                # Adicionar ao resultado
-                result["images"].append({
-                    "product_code": product_code,
-                    "image_filename": image_filename, 
-                    "image_base64": encoded_image
-                })
-        
+
+                if not product_code:
+                    product_code = f"unknown_product_{image_counter}"
+
+                jobs.append((image_counter, image_data, product_code))
+
+        b64_cache = {}  # digest -> base64 (catálogos repetem a mesma imagem)
+
+        def _process_one(job):
+            image_counter, image_data, product_code = job
+            # Nome primeiro, encode por último: se algo falhar antes, o maior
+            # buffer da iteração (~1.33x a imagem) nem chega a ser alocado
+            image_ext, image_mime = image_format(image_data)
+            image_filename = f"{_safe_name(product_code)}.{image_ext}"
+            image_hash = hashlib.sha1(image_data, usedforsecurity=False).digest()
+            try:
+                encoded_image = b64_cache.get(image_hash)
+                if encoded_image is None:
+                    encoded_image = b64_cache.setdefault(image_hash, _b64_stream(image_data))
+            except Exception as b64_err:
+                print(f"Erro Img {image_counter}: Erro ao converter para base64: {b64_err}", file=sys.stderr)
+                return None
+            return _dumps({
+                "product_code": product_code,
+                "image_filename": image_filename,
+                "image_base64": encoded_image,
+                "image_hash": image_hash.hex(),
+                "mime": image_mime
+            })
+
+        # hash + base64 + sanitize são independentes por imagem; com várias
+        # imagens vale um pool de threads (pybase64 solta o GIL no encode).
+        # map preserva a ordem, então o streaming continua determinístico.
+        out.write(b'{"images":[')
+        started = True
+        first = True
+        if len(jobs) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+                entries = pool.map(_process_one, jobs, chunksize=4)
+                for entry in entries:
+                    if entry is None:
+                        continue
+                    if not first:
+                        out.write(b',')
+                    out.write(entry)
+                    first = False
+        else:
+            for job in jobs:
+                entry = _process_one(job)
+                if entry is None:
+                    continue
+                if not first:
+                    out.write(b',')
+                out.write(entry)
+                first = False
+
     except Exception as e:
-        result["error"] = str(e)
+        error = str(e)
         print(f"Erro geral na extração Python: {e}", file=sys.stderr)
-    
-    print(json.dumps(result))
+
+    if not started:
+        out.write(b'{"images":[')
+    out.write(b'],"error":' + _dumps(error) + b'}\n')
+    out.flush()
+
+def _run_batch():
+    """Modo lote: JSONL no stdin com {"file": ..., "out": ...} por linha.
+
+    Mantém um único processo Python vivo para vários arquivos, amortizando
+    o custo de startup/imports que o spawn-por-arquivo do lado Node paga a
+    cada planilha. Cada item produz uma linha de JSON no stdout.
+    """
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+            extract_images_from_excel(item["file"], item["out"])
+        except Exception as batch_err:
+            sys.stdout.buffer.write(
+                b'{"images":[],"error":' + _dumps(str(batch_err)) + b'}\n')
+            sys.stdout.buffer.flush()
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print(json.dumps({"error": "Argumentos inválidos! Uso: python script.py arquivo_excel.xlsx diretório_saída"}))
+    if "--batch" in sys.argv:
+        _run_batch()
+    elif len(sys.argv) == 3:
+        excel_file_path = sys.argv[1]
+        output_dir = sys.argv[2]
+        extract_images_from_excel(excel_file_path, output_dir)
+    else:
+        print(json.dumps({"error": "Argumentos inválidos! Uso: python script.py arquivo_excel.xlsx diretório_saída (ou --batch com JSONL no stdin)"}))
         sys.exit(1)
-    excel_file_path = sys.argv[1]
-    output_dir = sys.argv[2]
-    extract_images_from_excel(excel_file_path, output_dir)
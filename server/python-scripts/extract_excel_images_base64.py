@@ -1,42 +1,94 @@
 
-import openpyxl, os, sys, json, base64
+import concurrent.futures, hashlib, io, os, sys, json, zipfile
+
+try:
+    import pybase64 as _b64  # implementação SIMD; sem ela, base64 do stdlib
+except ImportError:
+    import base64 as _b64
+
+try:
+    import orjson
+    def _dumps(obj):
+        return orjson.dumps(obj)
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+def _b64_stream(data):
+    """Base64 em blocos de 48 KB (fronteira exata 3->4) via memoryview.
+
+    Evita materializar um segundo buffer do tamanho da imagem: cada bloco
+    codificado cabe em cache e vai direto para o StringIO.
+    """
+    mv = memoryview(data)
+    out = io.StringIO()
+    step = 48 * 1024
+    for i in range(0, len(mv), step):
+        out.write(_b64.b64encode(mv[i:i + step]).decode('ascii'))
+    return out.getvalue()
 
 def extract_images(excel_file_path):
-    wb = openpyxl.load_workbook(excel_file_path)
-    result = {"images_base64": [], "error": None}
+    # Streaming: cada base64 sai no stdout assim que codificado
+    out = sys.stdout.buffer
+    started = False
+    error = None
     try:
-        image_counter = 0
-        for sheet_name in wb.sheetnames:
-            sheet = wb[sheet_name]
-            if not hasattr(sheet, '_images'): continue
-            print(f"Planilha '{sheet_name}' tem {len(sheet._images)} imagens.", file=sys.stderr)
-            for image_obj in sheet._images:
-                image_counter += 1
-                image_data = None
+        # O .xlsx é um ZIP: para devolver apenas os base64 basta ler as
+        # entradas de xl/media/, sem carregar o workbook com openpyxl
+        # (que materializa todas as células só para chegarmos em _images)
+        with zipfile.ZipFile(excel_file_path, 'r') as excel_zip:
+            media_names = [n for n in excel_zip.namelist() if n.startswith('xl/media/')]
+            print(f"Arquivo tem {len(media_names)} imagens em xl/media/.", file=sys.stderr)
+            jobs = []
+            for image_counter, media_name in enumerate(media_names, start=1):
                 try:
-                    # Tentar acessar dados da imagem (callable ou atributo)
-                    if hasattr(image_obj, '_data') and callable(image_obj._data):
-                        data_result = image_obj._data()
-                        if isinstance(data_result, bytes): image_data = data_result
-                    elif hasattr(image_obj, '_data') and isinstance(image_obj._data, bytes):
-                         image_data = image_obj._data
-                    if not image_data: 
-                         print(f"Img {image_counter}: Dados binários inválidos/ausentes.", file=sys.stderr)
-                         continue
-                    
-                    # Converter para base64
-                    encoded_image = base64.b64encode(image_data).decode('utf-8')
-                    result["images_base64"].append(encoded_image)
-                    print(f"Img {image_counter}: Extraído base64 ({len(encoded_image)} chars)", file=sys.stderr)
-                    
+                    image_data = excel_zip.read(media_name)
                 except Exception as img_err:
                     print(f"Erro processando imagem {image_counter}: {img_err}", file=sys.stderr)
-                    
+                    continue
+                if not image_data:
+                    print(f"Img {image_counter}: Dados binários inválidos/ausentes.", file=sys.stderr)
+                    continue
+                jobs.append((image_counter, image_data))
+
+        b64_cache = {}  # digest -> base64 para blobs repetidos
+
+        def _process_one(job):
+            image_counter, image_data = job
+            try:
+                # Converter para base64 (cache por hash: mesma imagem, um encode)
+                image_hash = hashlib.sha1(image_data, usedforsecurity=False).digest()
+                encoded_image = b64_cache.get(image_hash)
+                if encoded_image is None:
+                    encoded_image = b64_cache.setdefault(image_hash, _b64_stream(image_data))
+                print(f"Img {image_counter}: Extraído base64 ({len(encoded_image)} chars)", file=sys.stderr)
+                return _dumps(encoded_image)
+            except Exception as img_err:
+                print(f"Erro processando imagem {image_counter}: {img_err}", file=sys.stderr)
+                return None
+
+        out.write(b'{"images_base64":[')
+        started = True
+        first = True
+        if len(jobs) > 1:
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count())
+            with pool:
+                entries = list(pool.map(_process_one, jobs, chunksize=4))
+        else:
+            entries = [_process_one(job) for job in jobs]
+        for entry in entries:
+            if entry is None: continue
+            if not first: out.write(b',')
+            out.write(entry)
+            first = False
+
     except Exception as e:
-        result["error"] = str(e)
+        error = str(e)
         print(f"Erro geral Python: {e}", file=sys.stderr)
-    
-    print(json.dumps(result))
+
+    if not started: out.write(b'{"images_base64":[')
+    out.write(b'],"error":' + _dumps(error) + b'}\n')
+    out.flush()
 
 if __name__ == "__main__":
     if len(sys.argv) != 2: # Só espera o caminho do arquivo
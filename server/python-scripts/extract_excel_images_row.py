@@ -1,58 +1,118 @@
 
-import openpyxl, os, sys, json, base64, re
+import concurrent.futures, hashlib, io, os, sys, json, zipfile
+
+try:
+    import pybase64 as _b64  # caminho SIMD para o encode; stdlib como reserva
+except ImportError:
+    import base64 as _b64
+
+try:
+    import orjson
+    def _dumps(obj):
+        return orjson.dumps(obj)
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+def _b64_stream(data):
+    """Base64 em blocos de 48 KB (fronteira exata 3->4) via memoryview.
+
+    Evita materializar um segundo buffer do tamanho da imagem: cada bloco
+    codificado cabe em cache e vai direto para o StringIO.
+    """
+    mv = memoryview(data)
+    out = io.StringIO()
+    step = 48 * 1024
+    for i in range(0, len(mv), step):
+        out.write(_b64.b64encode(mv[i:i + step]).decode('ascii'))
+    return out.getvalue()
+
+from xlsx_image_core import collect_anchors, image_format
+
+# Sanitização de nomes de arquivo: tudo que não for [A-Za-z0-9._-] vira '_'.
+# Substitui a regex r'[^w.-]' que, sem a contrabarra, destruía os códigos.
+_SAFE_TRANS = str.maketrans(
+    {c: '_' for c in map(chr, range(128)) if not (c.isalnum() or c in '._-')})
+
+def _safe_name(product_code):
+    return str(product_code).encode('ascii', 'replace').decode().translate(_SAFE_TRANS)
+
+
+def _anchored_media(zip_ref, names):
+    """[(linha 1-indexada da âncora, mídia)]; -1 para mídias sem âncora."""
+    anchors, unanchored = collect_anchors(zip_ref, names)
+    return ([(row, media_name) for row, _, media_name in anchors]
+            + [(-1, media_name) for media_name in unanchored])
 
 def extract_images_from_excel(excel_file_path, output_dir):
-    wb = openpyxl.load_workbook(excel_file_path)
-    result = {"images": [], "error": None}
+    # Streaming das entradas para o stdout, sem a lista completa em memória
+    out = sys.stdout.buffer
+    started = False
+    error = None
     try:
         if not os.path.exists(output_dir): os.makedirs(output_dir)
-        image_counter = 0
-        for sheet_name in wb.sheetnames:
-            sheet = wb[sheet_name]
-            if not hasattr(sheet, '_images'): continue
-            print(f"Planilha '{sheet_name}' tem {len(sheet._images)} imagens.", file=sys.stderr)
-            for image_obj in sheet._images:
+
+        # Mídias e linhas das âncoras direto do ZIP do .xlsx — nada de
+        # load_workbook nem sheet._images para um script que só precisa de
+        # (base64, linha) por imagem
+        with zipfile.ZipFile(excel_file_path, 'r') as zip_ref:
+            names = zip_ref.namelist()
+            anchors = _anchored_media(zip_ref, names)
+            print(f"Arquivo tem {len(anchors)} imagens.", file=sys.stderr)
+
+            jobs = []
+            image_counter = 0
+            for anchor_row, media_name in anchors:
                 image_counter += 1
-                image_data = None; product_code = None; anchor_row = -1
-                try:
-                    anchor_row = image_obj.anchor.to.row + 1 # <<< OBTER A LINHA
-                    if hasattr(image_obj, '_data') and callable(image_obj._data):
-                        data_result = image_obj._data()
-                        if isinstance(data_result, bytes): image_data = data_result
-                    elif hasattr(image_obj, '_data') and isinstance(image_obj._data, bytes):
-                        image_data = image_obj._data
-                    if not image_data: print(f"Falha Img {image_counter}: Dados binários inválidos.", file=sys.stderr); continue
-                except Exception as data_err: print(f"Erro Img {image_counter}: {data_err}", file=sys.stderr); continue
-                
-                temp_image_name = f"temp_img_{image_counter}.png"
-                temp_image_path = os.path.join(output_dir, temp_image_name)
                 try:
-                    with open(temp_image_path, "wb") as f: f.write(image_data)
-                except Exception as write_err: print(f"Erro Img {image_counter}: Salvar temp: {write_err}", file=sys.stderr); continue 
-                
-                # Encontrar código (opcional, menos crítico agora)
-                # ... (pode manter a lógica de busca de código aqui se quiser, mas não é essencial para o mapeamento)
-                
-                encoded_image = None
-                try:
-                    with open(temp_image_path, "rb") as image_file: encoded_image = base64.b64encode(image_file.read()).decode('utf-8')
-                except Exception as b64_err: print(f"Erro Img {image_counter}: Base64: {b64_err}", file=sys.stderr)
-                finally:
-                    if os.path.exists(temp_image_path): os.remove(temp_image_path)
-                if not encoded_image: continue
-                
-                # Gerar nome final seguro
-                # TERCEIRA TENTATIVA de Regex: Hífen escapado no final
-                safe_product_code = re.sub(r'[^w.-]', '_', str(product_code)) 
-                image_filename = f"{safe_product_code}.png"
-                
-                result["images"].append({
-                    "image_filename": image_filename, 
-                    "image_base64": encoded_image,
-                    "anchor_row": anchor_row 
-                })
-    except Exception as e: result["error"] = str(e); print(f"Erro geral Python: {e}", file=sys.stderr)
-    print(json.dumps(result))
+                    image_data = zip_ref.read(media_name)
+                except Exception as data_err:
+                    print(f"Erro Img {image_counter}: {data_err}", file=sys.stderr); continue
+                jobs.append((image_counter, image_data, anchor_row))
+
+        b64_cache = {}  # digest -> base64 para blobs repetidos
+
+        def _process_one(job):
+            image_counter, image_data, anchor_row = job
+            # Nome antes do encode: falhas saem cedo sem alocar o base64
+            image_ext, image_mime = image_format(image_data)
+            image_filename = f"{_safe_name(None)}.{image_ext}"
+            image_hash = hashlib.sha1(image_data, usedforsecurity=False).digest()
+            try:
+                encoded_image = b64_cache.get(image_hash)
+                if encoded_image is None:
+                    encoded_image = b64_cache.setdefault(image_hash, _b64_stream(image_data))
+            except Exception as b64_err:
+                print(f"Erro Img {image_counter}: Base64: {b64_err}", file=sys.stderr)
+                return None
+            return _dumps({
+                "image_filename": image_filename,
+                "image_base64": encoded_image,
+                "anchor_row": anchor_row,
+                "image_hash": image_hash.hex(),
+                "mime": image_mime
+            })
+
+        # Encode paralelo por imagem (map preserva a ordem do streaming)
+        out.write(b'{"images":[')
+        started = True
+        first = True
+        if len(jobs) > 1:
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count())
+            with pool:
+                entries = list(pool.map(_process_one, jobs, chunksize=4))
+        else:
+            entries = [_process_one(job) for job in jobs]
+        for entry in entries:
+            if entry is None: continue
+            if not first: out.write(b',')
+            out.write(entry)
+            first = False
+    except Exception as e:
+        error = str(e); print(f"Erro geral Python: {e}", file=sys.stderr)
+    if not started: out.write(b'{"images":[')
+    out.write(b'],"error":' + _dumps(error) + b'}\n')
+    out.flush()
 
 if __name__ == "__main__":
     if len(sys.argv) != 3: sys.exit(1)
@@ -1,45 +1,75 @@
-import openpyxl, os, sys, json, base64
+import os, sys, json, zipfile
+
+try:
+    import pybase64 as _b64  # kernels SIMD para o encode; stdlib se ausente
+except ImportError:
+    import base64 as _b64
+
+try:
+    import orjson
+    def _dumps(obj):
+        return orjson.dumps(obj)
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
 from openpyxl.utils.cell import coordinate_from_string, column_index_from_string
-from openpyxl.drawing.spreadsheet_drawing import TwoCellAnchor, OneCellAnchor
 
-def find_image_near_cell(sheet, target_row, target_col):
-    """Encontra a primeira imagem cuja âncora está na linha/coluna alvo ou uma linha acima."""
-    for img in sheet._images:
+from xlsx_image_core import sheet_anchors
+
+def find_image_near_cell(anchor_index, target_row, target_col):
+    """Mídia ancorada na célula alvo ou uma linha acima, via índice (linha, coluna).
+
+    O índice construído uma vez em _open_cached troca a varredura linear de
+    todas as âncoras por produto por duas consultas O(1); a célula exata tem
+    prioridade sobre a linha de cima.
+    """
+    return (anchor_index.get((target_row, target_col))
+            or anchor_index.get((target_row - 1, target_col)))
+
+_CACHE = {}  # caminho -> (ZipFile aberto, índice de âncoras da primeira planilha)
+_CACHE_MAX = 8
+
+def _open_cached(excel_file_path):
+    """ZipFile + índice de âncoras da primeira planilha, com cache LRU por caminho.
+
+    No modo --server o mesmo catálogo é consultado uma vez por produto;
+    manter o arquivo aberto e as âncoras parseadas amortiza o custo de
+    carga para as chamadas seguintes. dict preserva ordem de inserção, a
+    reinserção a cada acesso faz o papel de LRU.
+    """
+    entry = _CACHE.pop(excel_file_path, None)
+    if entry is None:
+        zip_ref = zipfile.ZipFile(excel_file_path, 'r')
+        all_anchors = sheet_anchors(zip_ref, zip_ref.namelist())
+        # Mantém o comportamento de olhar só a primeira planilha
+        first_sheet = all_anchors[0][0] if all_anchors else None
+        anchor_index = {}
+        for sheet_name, row, col, media_name in all_anchors:
+            # Primeira âncora de cada célula vence, como na varredura antiga
+            if sheet_name == first_sheet:
+                anchor_index.setdefault((row, col), media_name)
+        entry = (zip_ref, anchor_index)
+    _CACHE[excel_file_path] = entry
+    if len(_CACHE) > _CACHE_MAX:
+        old_path = next(iter(_CACHE))
+        old_zip, _old_index = _CACHE.pop(old_path)
         try:
-            anchor_row = img.anchor._from.row + 1
-            anchor_col = img.anchor._from.col + 1
-            
-            # Verifica se âncora está na célula exata OU uma linha acima na mesma coluna
-            if (anchor_row == target_row and anchor_col == target_col) or \
-               (anchor_row == target_row - 1 and anchor_col == target_col):
-                if hasattr(img, '_data') and callable(img._data):
-                    data = img._data()
-                    if isinstance(data, bytes): return data
-                elif hasattr(img, '_data') and isinstance(img._data, bytes):
-                    return img._data
-        except Exception as e:
-            print(f"Erro processando âncora de imagem: {e}", file=sys.stderr)
-            continue
-    return None
+            old_zip.close()
+        except Exception:
+            pass
+    return entry
 
-def extract_image_for_product(excel_file_path, product_info_json):
+def extract_image_for_product(excel_file_path, product_info):
     result = {"product_row": None, "image_base64": None, "error": None}
     try:
-        product_info = json.loads(product_info_json)
         target_row = product_info.get('excelRowNumber')
         image_cell = product_info.get('imageCell') # Ex: "F3"
         result["product_row"] = target_row
 
         if not target_row or not image_cell:
             result["error"] = "Informações do produto incompletas (excelRowNumber ou imageCell ausente)"
-            print(json.dumps(result))
-            return
-
-        wb = openpyxl.load_workbook(excel_file_path)
-        
-        # Assume a primeira planilha por enquanto (poderia ser passado se necessário)
-        # TODO: Considerar múltiplas planilhas se a estrutura do catálogo exigir
-        sheet = wb.worksheets[0] 
+            return result
 
         # Converte a referência da célula (ex: "F3") para coluna e linha
         try:
@@ -49,21 +79,23 @@ def extract_image_for_product(excel_file_path, product_info_json):
             # a linha da imageCell pode ser apenas uma dica de coluna.
         except ValueError:
              result["error"] = f"Referência de célula inválida fornecida pela IA: {image_cell}"
-             print(json.dumps(result))
-             return
+             return result
 
         print(f"Buscando imagem para Produto Linha {target_row}, Célula Alvo {image_cell} (Col {target_col_index})", file=sys.stderr)
 
-        image_data = find_image_near_cell(sheet, target_row, target_col_index)
-        
+        zip_ref, anchor_index = _open_cached(excel_file_path)
+
+        media_name = find_image_near_cell(anchor_index, target_row, target_col_index)
+
         # Fallback: Se não achou na coluna exata, tentar coluna adjacente esquerda (E se F falhar)
-        if not image_data and target_col_index > 1:
+        if not media_name and target_col_index > 1:
              print(f"Imagem não encontrada na Col {target_col_index}, tentando Col {target_col_index - 1}", file=sys.stderr)
-             image_data = find_image_near_cell(sheet, target_row, target_col_index - 1)
+             media_name = find_image_near_cell(anchor_index, target_row, target_col_index - 1)
 
-        if image_data:
+        if media_name:
             try:
-                result["image_base64"] = base64.b64encode(image_data).decode('utf-8')
+                image_data = zip_ref.read(media_name)
+                result["image_base64"] = _b64.b64encode(image_data).decode('utf-8')
                 print(f"Imagem encontrada e codificada para produto linha {target_row}", file=sys.stderr)
             except Exception as encode_err:
                 result["error"] = f"Erro ao codificar imagem: {encode_err}"
@@ -74,15 +106,42 @@ def extract_image_for_product(excel_file_path, product_info_json):
     except Exception as e:
         result["error"] = f"Erro geral no Python: {e}"
         print(f"ERRO PYTHON: {e}", file=sys.stderr)
-    
-    print(json.dumps(result))
+
+    return result
+
+def _run_server():
+    """Modo worker persistente: uma requisição JSON por linha no stdin.
+
+    Cada linha traz {"excel_path": ..., "product_info": {...}}; a resposta
+    sai como uma linha de JSON no stdout. O processo fica vivo entre as
+    chamadas, então o cache de âncoras elimina o custo de carga do
+    workbook a partir da segunda consulta ao mesmo arquivo.
+    """
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+            result = extract_image_for_product(
+                request["excel_path"], request.get("product_info") or {})
+        except Exception as req_err:
+            result = {"product_row": None, "image_base64": None,
+                      "error": f"Requisição inválida: {req_err}"}
+        sys.stdout.buffer.write(_dumps(result) + b'\n')
+        sys.stdout.buffer.flush()
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print(json.dumps({"error": "Argumentos inválidos! Uso: python script.py arquivo_excel.xlsx 'json_produto'"}))
+    if "--server" in sys.argv:
+        _run_server()
+    elif len(sys.argv) == 3:
+        excel_file_path = sys.argv[1]
+        try:
+            product_info = json.loads(sys.argv[2])
+        except Exception as parse_err:
+            print(json.dumps({"error": f"JSON do produto inválido: {parse_err}"}))
+            sys.exit(1)
+        sys.stdout.buffer.write(_dumps(extract_image_for_product(excel_file_path, product_info)) + b'\n')
+    else:
+        print(json.dumps({"error": "Argumentos inválidos! Uso: python script.py arquivo_excel.xlsx 'json_produto' (ou --server)"}))
         sys.exit(1)
-    
-    excel_file_path = sys.argv[1]
-    product_info_json = sys.argv[2]
-    
-    extract_image_for_product(excel_file_path, product_info_json) 
\ No newline at end of file
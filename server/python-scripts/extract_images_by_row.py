@@ -1,101 +1,111 @@
-import openpyxl, os, sys, json, base64
-from openpyxl.drawing.spreadsheet_drawing import TwoCellAnchor, OneCellAnchor
+import concurrent.futures, hashlib, os, sys, json, zipfile
+
+try:
+    import pybase64 as _b64  # encode vetorizado (AVX2); cai para o stdlib
+except ImportError:
+    import base64 as _b64
+
+try:
+    import orjson
+    def _dumps(obj):
+        return orjson.dumps(obj)
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+from xlsx_image_core import sheet_anchors
 
 def extract_images_by_row(excel_file_path):
     """Extrai todas as imagens, a linha de suas âncoras E O NOME DA PLANILHA de todas as planilhas."""
     print(f"[Python DEBUG] Script recebendo caminho: {excel_file_path}", file=sys.stderr)
-    try:
-        wb = openpyxl.load_workbook(excel_file_path)
-        print(f"[Python DEBUG] Workbook carregado. Planilhas encontradas: {len(wb.sheetnames)} -> {wb.sheetnames}", file=sys.stderr)
-    except Exception as load_err:
-        print(f"[Python FATAL] Erro ao carregar workbook de {excel_file_path}: {load_err}", file=sys.stderr)
-        print(json.dumps({"images": [], "error": f"Erro ao carregar workbook: {load_err}"}))
-        sys.exit(1) 
-        
-    result = {"images": [], "error": None}
+    # Streaming: cada imagem é serializada e escrita no stdout assim que o
+    # base64 fica pronto, em vez de acumular a lista inteira (pico de RSS
+    # de N x imagem) e serializar tudo no final. O envelope continua o
+    # mesmo JSON único que o catalog-processor.ts espera.
+    out = sys.stdout.buffer
+    started = False
+    error = None
     images_processed_total = 0
-    
-    try:
-        for sheet_name in wb.sheetnames:
-            print(f"\n[Python DEBUG] Processando planilha: '{sheet_name}'", file=sys.stderr)
-            sheet = wb[sheet_name]
-            image_counter_sheet = 0
-            images_processed_sheet = 0
 
-            # DEBUG: SEMPRE verificar e logar _drawing count
-            drawing_count = 0
-            if hasattr(sheet, '_drawing') and sheet._drawing and hasattr(sheet._drawing, 'drawing_list'):
-                drawing_count = len(sheet._drawing.drawing_list)
-                if drawing_count > 0:
-                    print(f"[Python DEBUG] Planilha '{sheet_name}' contém {drawing_count} objetos de desenho.", file=sys.stderr)
-                # else: # Logar se não houver desenhos é muito verboso
-                #    print(f"[Python DEBUG] Planilha '{sheet_name}' não contém objetos de desenho.", file=sys.stderr) 
-            else:
-                 print(f"[Python DEBUG] Atributo '_drawing' não encontrado ou vazio na planilha '{sheet_name}'.", file=sys.stderr)
-            
-            # Tentar processar _images se existir e não estiver vazio
-            if hasattr(sheet, '_images') and len(sheet._images) > 0: 
-                print(f"[Python DEBUG] Atributo '_images' existe. Verificando {len(sheet._images)} imagens em '{sheet_name}'...", file=sys.stderr)
-                for image_obj in sheet._images:
-                    image_counter_sheet += 1
-                    image_data = None
-                    anchor_row = -1
-                    try:
-                        if hasattr(image_obj, 'anchor') and hasattr(image_obj.anchor, '_from') and hasattr(image_obj.anchor._from, 'row'):
-                           anchor_row = image_obj.anchor._from.row + 1 
-                        else:
-                           print(f"Warn: Img {image_counter_sheet} em '{sheet_name}' (tipo: {type(image_obj)}) sem âncora válida.", file=sys.stderr)
-                           continue
+    try:
+        # Ler âncoras e mídias direto do ZIP do .xlsx — sem load_workbook
+        # nem sheet._images, que exigiriam o DOM completo do openpyxl
+        with zipfile.ZipFile(excel_file_path, 'r') as zip_ref:
+            names = zip_ref.namelist()
+            anchors = sheet_anchors(zip_ref, names)
+            print(f"[Python DEBUG] Workbook aberto via ZIP. {len(anchors)} âncoras de imagem encontradas.", file=sys.stderr)
 
-                        if hasattr(image_obj, '_data') and callable(image_obj._data):
-                            data = image_obj._data()
-                            if isinstance(data, bytes):
-                                image_data = data
-                        elif hasattr(image_obj, '_data') and isinstance(image_obj._data, bytes):
-                             image_data = image_obj._data
+            # Passada serial no ZIP (não é thread-safe) coletando os bytes;
+            # o encode pesado vai para o pool logo abaixo
+            jobs = []
+            image_counter = 0
+            for sheet_name, anchor_row, _anchor_col, media_name in anchors:
+                image_counter += 1
+                try:
+                    image_data = zip_ref.read(media_name)
+                except Exception as data_err:
+                    print(f"Erro ao ler Img {image_counter} ({media_name}): {data_err}", file=sys.stderr)
+                    continue
+                if not image_data:
+                    print(f"Warn: Img {image_counter} em '{sheet_name}' sem dados binários.", file=sys.stderr)
+                    continue
+                jobs.append((image_counter, image_data, anchor_row, sheet_name))
 
-                        if image_data is None:
-                            print(f"Warn: Img {image_counter_sheet} em '{sheet_name}' (Linha Âncora {anchor_row}) não foi possível extrair dados binários.", file=sys.stderr)
-                            continue
-                        
-                        if image_data is not None and anchor_row != -1:
-                            try:
-                                encoded_image = base64.b64encode(image_data).decode('utf-8')
-                                result["images"].append({
-                                    "anchor_row": anchor_row,
-                                    "image_base64": encoded_image,
-                                    "sheet_name": sheet_name
-                                })
-                                images_processed_sheet += 1
-                            except Exception as encode_err:
-                                print(f"[Python WARN] Erro ao codificar Img {image_counter_sheet} da linha {anchor_row} (Planilha: {sheet_name}): {encode_err}", file=sys.stderr)
+        b64_cache = {}  # digest -> base64 para blobs repetidos
 
-                    except Exception as img_err:
-                         print(f"Erro ao processar Img {image_counter_sheet} em '{sheet_name}': {img_err}", file=sys.stderr)
-            
-            # Se _images estava vazio, mas _drawing tinha algo, logar isso (ainda sem extrair de _drawing)
-            elif drawing_count > 0: 
-                 print(f"[Python INFO] '_images' estava vazio, mas {drawing_count} objetos de desenho foram encontrados em '{sheet_name}' (extração de desenhos não implementada).", file=sys.stderr)
-            else: # Nem _images nem _drawing
-                 print(f"[Python WARN] Nenhuma imagem encontrada em '{sheet_name}' via '_images' ou '_drawing'.", file=sys.stderr)
+        def _process_one(job):
+            image_counter, image_data, anchor_row, sheet_name = job
+            try:
+                # Catálogos repetem a mesma foto em várias âncoras; o sha1
+                # garante um único encode por conteúdo
+                image_hash = hashlib.sha1(image_data, usedforsecurity=False).digest()
+                encoded_image = b64_cache.get(image_hash)
+                if encoded_image is None:
+                    encoded_image = b64_cache.setdefault(
+                        image_hash, _b64.b64encode(image_data).decode('utf-8'))
+                return _dumps({
+                    "anchor_row": anchor_row,
+                    "image_base64": encoded_image,
+                    "sheet_name": sheet_name
+                })
+            except Exception as encode_err:
+                print(f"[Python WARN] Erro ao codificar Img {image_counter} da linha {anchor_row} (Planilha: {sheet_name}): {encode_err}", file=sys.stderr)
+                return None
 
-            images_processed_total += images_processed_sheet
-            if images_processed_sheet > 0:
-                 print(f"[Python DEBUG] Planilha '{sheet_name}' concluída. {images_processed_sheet} imagens processadas a partir de '_images'.", file=sys.stderr)
-            # else: # Não logar se não processou nada
-            #    print(f"[Python DEBUG] Nenhuma imagem processada a partir de '_images' na planilha '{sheet_name}'.", file=sys.stderr)
+        # Encode paralelo por imagem (pybase64 solta o GIL); map preserva a
+        # ordem, então o streaming continua determinístico
+        out.write(b'{"images":[')
+        started = True
+        first = True
+        if len(jobs) > 1:
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count())
+            with pool:
+                entries = list(pool.map(_process_one, jobs, chunksize=4))
+        else:
+            entries = [_process_one(job) for job in jobs]
+        for entry in entries:
+            if entry is None:
+                continue
+            if not first:
+                out.write(b',')
+            out.write(entry)
+            first = False
+            images_processed_total += 1
 
         print(f"\nExtração Python FINALIZADA. Total de {images_processed_total} imagens processadas em todas as planilhas.", file=sys.stderr)
 
     except Exception as e:
         print(f"Erro GERAL na extração Python: {e}", file=sys.stderr)
-        result["error"] = str(e)
+        error = str(e)
 
-    print(json.dumps(result))
+    if not started:
+        out.write(b'{"images":[')
+    out.write(b'],"error":' + _dumps(error) + b'}\n')
+    out.flush()
 
 if __name__ == "__main__":
     if len(sys.argv) > 1:
         excel_file_path = sys.argv[1]
         extract_images_by_row(excel_file_path)
     else:
-        print(json.dumps({"images": [], "error": "Caminho do arquivo Excel não fornecido."})) 
\ No newline at end of file
+        print(json.dumps({"images": [], "error": "Caminho do arquivo Excel não fornecido."}))
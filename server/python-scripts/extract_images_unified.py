@@ -0,0 +1,77 @@
+import hashlib, sys, json, zipfile
+
+try:
+    import pybase64 as _b64  # encode SIMD; stdlib como reserva
+except ImportError:
+    import base64 as _b64
+
+try:
+    import orjson
+    def _dumps(obj):
+        return orjson.dumps(obj)
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+from xlsx_image_core import image_format, sheet_anchors
+
+def extract_images_unified(excel_file_path):
+    """Extração única para os fluxos por linha, por coluna e de mapeamento.
+
+    Em vez de rodar três scripts sobre o mesmo arquivo (três startups de
+    Python, três parses do .xlsx e três encodes), emite uma linha NDJSON
+    por imagem com todos os campos que os consumidores precisam:
+
+        {"anchor_row", "anchor_col", "sheet_name", "image_base64",
+         "image_mime", "image_hash"}
+
+    e encerra com {"done": true, "error": ...}. O lado Node filtra por
+    linha ou coluna em memória.
+    """
+    out = sys.stdout.buffer
+    error = None
+    try:
+        with zipfile.ZipFile(excel_file_path, 'r') as zip_ref:
+            names = zip_ref.namelist()
+            anchors = sheet_anchors(zip_ref, names)
+            print(f"{len(anchors)} âncoras de imagem encontradas.", file=sys.stderr)
+
+            b64_cache = {}  # digest -> base64 para blobs repetidos
+            for image_counter, (sheet_name, anchor_row, anchor_col, media_name) in enumerate(anchors, start=1):
+                try:
+                    image_data = zip_ref.read(media_name)
+                except Exception as data_err:
+                    print(f"Erro ao ler Img {image_counter} ({media_name}): {data_err}", file=sys.stderr)
+                    continue
+                if not image_data:
+                    continue
+
+                try:
+                    image_hash = hashlib.sha1(image_data, usedforsecurity=False).digest()
+                    encoded_image = b64_cache.get(image_hash)
+                    if encoded_image is None:
+                        encoded_image = b64_cache.setdefault(
+                            image_hash, _b64.b64encode(image_data).decode('ascii'))
+                    _image_ext, image_mime = image_format(image_data)
+                    out.write(_dumps({
+                        "anchor_row": anchor_row,
+                        "anchor_col": anchor_col,
+                        "sheet_name": sheet_name,
+                        "image_base64": encoded_image,
+                        "image_mime": image_mime,
+                        "image_hash": image_hash.hex()
+                    }) + b'\n')
+                except Exception as img_err:
+                    print(f"Erro processando Img {image_counter}: {img_err}", file=sys.stderr)
+    except Exception as e:
+        error = str(e)
+        print(f"Erro geral Python: {e}", file=sys.stderr)
+
+    out.write(b'{"done":true,"error":' + _dumps(error) + b'}\n')
+    out.flush()
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print(json.dumps({"done": True, "error": "Uso: python extract_images_unified.py arquivo.xlsx"}))
+        sys.exit(1)
+    extract_images_unified(sys.argv[1])
@@ -14,13 +14,12 @@ A lógica implementada considera:
 import os
 import sys
 import json
-import shutil
 import zipfile
-import xml.etree.ElementTree as ET
-import tempfile
-from pathlib import Path
-from PIL import Image
-from io import BytesIO
+
+try:
+    from lxml import etree as ET  # parser em C (libxml2); bem mais rápido
+except ImportError:
+    import xml.etree.ElementTree as ET
 
 # Função principal: processar o arquivo Excel e extrair mapeamento de imagens
 def process_excel_file(excel_path, output_dir):
@@ -39,102 +38,96 @@ def process_excel_file(excel_path, output_dir):
             "images": []
         }
         
-        # Extrair o arquivo Excel (que é um arquivo ZIP)
-        temp_dir = tempfile.mkdtemp()
-        
-        try:
-            with zipfile.ZipFile(excel_path, 'r') as zip_ref:
-                zip_ref.extractall(temp_dir)
-            
+        # O Excel é um arquivo ZIP: ler as entradas direto dele, sem
+        # extractall para um diretório temporário
+        with zipfile.ZipFile(excel_path, 'r') as zip_ref:
+            names = zip_ref.namelist()
+
             # Analisar a pasta de mídias
-            media_dir = os.path.join(temp_dir, 'xl', 'media')
-            if not os.path.exists(media_dir):
+            media_names = {os.path.basename(n): n for n in names
+                           if n.startswith('xl/media/')}
+            if not media_names:
                 print(f"Nenhuma pasta de mídia encontrada no arquivo Excel")
                 return {"error": "Nenhuma imagem encontrada no arquivo Excel"}
-            
+
             # Mapear imagens em relação às células na coluna D
-            worksheet_rels_dir = os.path.join(temp_dir, 'xl', 'worksheets', '_rels')
-            if os.path.exists(worksheet_rels_dir):
-                sheet_rels_files = [f for f in os.listdir(worksheet_rels_dir) if f.endswith('.xml.rels')]
-                
-                for sheet_rel_file in sheet_rels_files:
-                    # Analisar arquivo de relações
-                    sheet_rel_path = os.path.join(worksheet_rels_dir, sheet_rel_file)
-                    tree = ET.parse(sheet_rel_path)
-                    root = tree.getroot()
-                    
-                    # Namespace para XML
-                    ns = {'r': 'http://schemas.openxmlformats.org/package/2006/relationships'}
-                    
-                    # Coletar todas as relações de imagem
-                    for relationship in root.findall('.//r:Relationship', ns):
-                        rel_type = relationship.get('Type')
-                        if 'image' in rel_type:
-                            rel_id = relationship.get('Id')
-                            target = relationship.get('Target')
-                            
-                            # Extrair o nome do arquivo de imagem do caminho Target
-                            image_filename = os.path.basename(target)
-                            
-                            # Verificar se o arquivo existe na pasta media
-                            image_path = os.path.join(media_dir, image_filename)
-                            if os.path.exists(image_path):
-                                # Copiar imagem para o diretório de saída
-                                new_image_name = f"img_{rel_id}_{image_filename}"
-                                output_path = os.path.join(output_dir, new_image_name)
-                                
-                                # Copiar a imagem
-                                try:
-                                    shutil.copy2(image_path, output_path)
-                                    print(f"Imagem extraída: {new_image_name}")
-                                    
-                                    # Adicionar ao mapeamento
-                                    image_mapping["images"].append({
-                                        "relationship_id": rel_id,
-                                        "original_filename": image_filename,
-                                        "extracted_filename": new_image_name,
-                                        "path": os.path.join(output_dir, new_image_name)
-                                    })
-                                except Exception as copy_error:
-                                    print(f"Erro ao copiar imagem {image_filename}: {copy_error}")
-            
+            sheet_rels_files = [n for n in names
+                                if n.startswith('xl/worksheets/_rels/') and n.endswith('.xml.rels')]
+
+            for sheet_rel_file in sheet_rels_files:
+                # Analisar arquivo de relações
+                root = ET.fromstring(zip_ref.read(sheet_rel_file))
+
+                # Namespace para XML
+                ns = {'r': 'http://schemas.openxmlformats.org/package/2006/relationships'}
+
+                # Coletar todas as relações de imagem
+                for relationship in root.findall('.//r:Relationship', ns):
+                    rel_type = relationship.get('Type')
+                    if 'image' in rel_type:
+                        rel_id = relationship.get('Id')
+                        target = relationship.get('Target')
+
+                        # Extrair o nome do arquivo de imagem do caminho Target
+                        image_filename = os.path.basename(target)
+
+                        # Verificar se o arquivo existe na pasta media
+                        media_entry = media_names.get(image_filename)
+                        if media_entry:
+                            # Gravar a imagem uma única vez no destino final
+                            # (antes: extractall + shutil.copy2 = duas escritas)
+                            new_image_name = f"img_{rel_id}_{image_filename}"
+                            output_path = os.path.join(output_dir, new_image_name)
+
+                            try:
+                                with open(output_path, 'wb') as f:
+                                    f.write(zip_ref.read(media_entry))
+                                print(f"Imagem extraída: {new_image_name}")
+
+                                # Adicionar ao mapeamento
+                                image_mapping["images"].append({
+                                    "relationship_id": rel_id,
+                                    "original_filename": image_filename,
+                                    "extracted_filename": new_image_name,
+                                    "path": os.path.join(output_dir, new_image_name)
+                                })
+                            except Exception as copy_error:
+                                print(f"Erro ao copiar imagem {image_filename}: {copy_error}")
+
             # Encontrar arquivo de desenho para mapear células específicas
-            drawings_dir = os.path.join(temp_dir, 'xl', 'drawings')
-            if os.path.exists(drawings_dir):
-                drawing_files = [f for f in os.listdir(drawings_dir) if f.endswith('.xml')]
-                
-                for drawing_file in drawing_files:
-                    drawing_path = os.path.join(drawings_dir, drawing_file)
-                    try:
-                        tree = ET.parse(drawing_path)
-                        root = tree.getroot()
-                        
-                        # Procurar todos os namespaces no arquivo XML
-                        namespaces = dict([node for _, node in ET.iterparse(drawing_path, events=['start-ns'])])
-                        
-                        # Adicionar xdr namespace se não estiver presente
-                        if 'xdr' not in namespaces:
-                            namespaces['xdr'] = 'http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing'
-                        
-                        # Mapear imagens para células
-                        for anchor in root.findall('.//xdr:oneCellAnchor', namespaces):
+            drawing_files = [n for n in names
+                             if n.startswith('xl/drawings/') and n.endswith('.xml')]
+
+            _XDR = '{http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing}'
+            _A = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+
+            for drawing_file in drawing_files:
+                try:
+                    # Uma única passada streaming: cada oneCellAnchor é tratado
+                    # no evento de fechamento e liberado com elem.clear(), sem
+                    # manter o DOM do drawing inteiro em memória
+                    with zip_ref.open(drawing_file) as drawing_fp:
+                        for _event, anchor in ET.iterparse(drawing_fp):
+                            if anchor.tag != _XDR + 'oneCellAnchor':
+                                continue
+
                             # Pegar a referência da célula
-                            from_cell = anchor.find('.//xdr:from', namespaces)
+                            from_cell = anchor.find(_XDR + 'from')
                             if from_cell is not None:
-                                col = from_cell.find('.//xdr:col', namespaces)
-                                row = from_cell.find('.//xdr:row', namespaces)
-                                
+                                col = from_cell.find(_XDR + 'col')
+                                row = from_cell.find(_XDR + 'row')
+
                                 if col is not None and row is not None:
                                     col_num = int(col.text)
                                     row_num = int(row.text) + 1  # Rows are 0-indexed in XML
-                                    
+
                                     # Se a imagem estiver na coluna D (índice 3)
                                     if col_num == 3:  # Coluna D é índice 3 (0-indexed)
                                         # Encontrar ID da imagem vinculada
-                                        blip = anchor.find('.//a:blip', namespaces)
+                                        blip = anchor.find('.//' + _A + 'blip')
                                         if blip is not None:
                                             embed = blip.get('{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed')
-                                            
+
                                             # Atualizar o mapeamento para esta imagem
                                             for img in image_mapping["images"]:
                                                 if img["relationship_id"] == embed:
@@ -143,21 +136,18 @@ def process_excel_file(excel_path, output_dir):
                                                     img["column"] = "D"
                                                     img["column_index"] = 4  # Coluna D é a 4ª coluna
                                                     break
-                    except Exception as drawing_error:
-                        print(f"Erro ao processar desenho {drawing_file}: {drawing_error}")
-            
-            # Salvar o mapeamento como JSON
-            mapping_file = os.path.join(output_dir, f"{base_name}_image_mapping.json")
-            with open(mapping_file, 'w', encoding='utf-8') as f:
-                json.dump(image_mapping, f, ensure_ascii=False, indent=2)
-            
-            print(f"Mapeamento de imagens criado em: {mapping_file}")
-            return image_mapping
-            
-        finally:
-            # Limpar diretório temporário
-            shutil.rmtree(temp_dir)
-    
+                            anchor.clear()
+                except Exception as drawing_error:
+                    print(f"Erro ao processar desenho {drawing_file}: {drawing_error}")
+
+        # Salvar o mapeamento como JSON
+        mapping_file = os.path.join(output_dir, f"{base_name}_image_mapping.json")
+        with open(mapping_file, 'w', encoding='utf-8') as f:
+            json.dump(image_mapping, f, ensure_ascii=False, indent=2)
+
+        print(f"Mapeamento de imagens criado em: {mapping_file}")
+        return image_mapping
+
     except Exception as e:
         print(f"Erro ao processar arquivo Excel: {str(e)}")
         return {"error": str(e)}
@@ -1,14 +1,115 @@
 
+import concurrent.futures
 import os
+import shutil
 import sys
 import json
 import re
-import base64
 import zipfile
-from io import BytesIO
-from PIL import Image
 
-def extract_images_from_excel(excel_path, output_dir):
+try:
+    import pybase64 as _b64  # encode SIMD (libbase64); stdlib como reserva
+except ImportError:
+    import base64 as _b64
+
+try:
+    import orjson
+    def _dumps(obj):
+        return orjson.dumps(obj)
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+import io
+
+try:
+    from lxml import etree as _etree  # iterparse em C; stdlib como reserva
+except ImportError:
+    import xml.etree.ElementTree as _etree
+
+# Padrões usados por entrada do ZIP, compilados uma vez no import
+_SAFE_RE = re.compile(r'[^\w\-\.]')
+
+# Extensões aceitas no fallback via .rels (mesma lista do regex antigo)
+_REL_EXTS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff')
+
+def _rel_image_targets(rel_stream):
+    """Targets de imagem de um .rels, direto do stream do ZIP.
+
+    iterparse evita decodificar o XML inteiro para uma string e varrê-la
+    com regex; o clear() mantém a árvore limitada ao elemento corrente,
+    então a memória é constante seja qual for o tamanho do .rels.
+    """
+    for _event, element in _etree.iterparse(rel_stream, events=('end',)):
+        if element.tag.endswith('Relationship'):
+            target = element.get('Target', '')
+            if target.lower().endswith(_REL_EXTS):
+                yield target
+        element.clear()
+
+# Filtro de entradas de imagem: startswith/endswith aceitam tuplas e fazem a
+# checagem multi-prefixo/sufixo em C, sem regex por nome de arquivo
+_IMG_EXTS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.emf')
+_IMG_PREFIXES = ('xl/media/', 'xl/drawings/', 'word/media/')
+
+def _b64_stream(data):
+    """Base64 em blocos de 48 KB (fronteira exata 3->4) via memoryview.
+
+    Evita materializar um segundo buffer de bytes do tamanho da imagem ao
+    lado do original: cada bloco codificado cabe em cache e vai direto
+    para o StringIO.
+    """
+    mv = memoryview(data)
+    out = io.StringIO()
+    step = 48 * 1024
+    for i in range(0, len(mv), step):
+        out.write(_b64.b64encode(mv[i:i + step]).decode('ascii'))
+    return out.getvalue()
+
+def _extract_one(args):
+    """Extrai, grava e codifica uma entrada de imagem; roda em um worker.
+
+    O ZipFile não é compartilhável entre processos, então cada worker abre
+    o seu — a abertura e a leitura de uma única entrada são baratas perto
+    da decompressão + encode, que são o trabalho CPU-bound paralelizado.
+    """
+    excel_path, img_path, output_dir, img_index, inline_base64 = args
+    try:
+        # Remover caracteres problemáticos do nome e prefixar o índice
+        # para evitar sobreposição
+        safe_filename = _SAFE_RE.sub('_', os.path.basename(img_path))
+        temp_path = os.path.join(output_dir, f"img_{img_index}_{safe_filename}")
+
+        # Extrair a imagem para o disco. Com base64 inline os bytes são
+        # lidos uma vez e reaproveitados no encode; sem base64 a cópia sai
+        # em blocos de 64 KB, sem segurar a imagem inteira em memória
+        with zipfile.ZipFile(excel_path, 'r') as excel_zip:
+            with excel_zip.open(img_path) as img_file:
+                if inline_base64:
+                    img_data = img_file.read()
+                    with open(temp_path, 'wb') as out_file:
+                        out_file.write(img_data)
+                else:
+                    with open(temp_path, 'wb') as out_file:
+                        shutil.copyfileobj(img_file, out_file, 65536)
+
+        # O base64 é opcional — sem ele o consumidor usa image_path e o
+        # pico de RSS cai para o tamanho da maior imagem
+        entry = {
+            "image_path": temp_path,
+            "image_filename": os.path.basename(temp_path),
+            "original_path": img_path
+        }
+        if inline_base64:
+            entry["image_base64"] = _b64_stream(img_data)
+
+        print(f"Imagem {img_index+1} extraída: {temp_path}")
+        return entry
+    except Exception as e:
+        print(f"Erro ao extrair imagem {img_path}: {str(e)}")
+        return None
+
+def extract_images_from_excel(excel_path, output_dir, inline_base64=True):
     """Extrai imagens de um arquivo Excel usando múltiplos métodos"""
     result = {
         "images": [],
@@ -22,43 +123,51 @@ def extract_images_from_excel(excel_path, output_dir):
         # Método 1: Extrair diretamente do ZIP (Excel é um arquivo ZIP)
         with zipfile.ZipFile(excel_path, 'r') as excel_zip:
             # Procurar por arquivos de imagem em locais comuns
-            image_paths = [f for f in excel_zip.namelist() if
-                          re.search(r'\.(png|jpe?g|gif|bmp|tiff|emf)$', f, re.IGNORECASE) and
-                          ('xl/media/' in f or 'xl/drawings/' in f or 'word/media/' in f)]
-            
-            print(f"Encontrados {len(image_paths)} arquivos de imagem no Excel")
-            
-            # Extrair cada imagem
-            for img_index, img_path in enumerate(image_paths):
-                try:
-                    # Extrair o nome do arquivo
-                    img_filename = os.path.basename(img_path)
-                    # Remover caracteres problemáticos
-                    safe_filename = re.sub(r'[^\w\-\.]', '_', img_filename)
-                    # Adicionar índice para evitar sobreposição
-                    temp_path = os.path.join(output_dir, f"img_{img_index}_{safe_filename}")
-                    
-                    # Extrair a imagem para o disco
-                    with excel_zip.open(img_path) as img_file:
-                        img_data = img_file.read()
-                        
-                        with open(temp_path, 'wb') as out_file:
-                            out_file.write(img_data)
-                        
-                        # Converter para base64 para retorno
-                        img_base64 = base64.b64encode(img_data).decode('utf-8')
-                        
-                        # Adicionar ao resultado
-                        result["images"].append({
-                            "image_path": temp_path,
-                            "image_filename": os.path.basename(temp_path),
-                            "original_path": img_path,
-                            "image_base64": img_base64
-                        })
-                        
-                        print(f"Imagem {img_index+1} extraída: {temp_path}")
-                except Exception as e:
-                    print(f"Erro ao extrair imagem {img_path}: {str(e)}")
+            image_infos = [info for info in excel_zip.infolist() if
+                          (lf := info.filename.lower()).endswith(_IMG_EXTS) and
+                          lf.startswith(_IMG_PREFIXES)]
+
+            print(f"Encontrados {len(image_infos)} arquivos de imagem no Excel")
+
+            # Planilhas reutilizam o mesmo blob em várias entradas (logos
+            # etc.). O par (CRC, tamanho) vem de graça do diretório central
+            # do ZIP e identifica o conteúdo sem ler a entrada; só a
+            # primeira ocorrência vira um job de extração
+            seen = {}
+            jobs = []         # (caminho no ZIP, índice original) por conteúdo único
+            occurrences = []  # (índice original, caminho, índice do job dono)
+            for img_index, info in enumerate(image_infos):
+                key = (info.CRC, info.file_size)
+                owner = seen.get(key)
+                if owner is None:
+                    owner = len(jobs)
+                    seen[key] = owner
+                    jobs.append((info.filename, img_index))
+                occurrences.append((img_index, info.filename, owner))
+
+            # Extração + encode por imagem são independentes e CPU-bound
+            # (zlib + base64); um pool de processos resolve as únicas em
+            # paralelo e map preserva a ordem dos jobs
+            job_args = [(excel_path, img_path, output_dir, img_index, inline_base64)
+                        for img_path, img_index in jobs]
+            if len(job_args) > 1:
+                max_workers = min(os.cpu_count() or 1, 4)
+                with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as pool:
+                    extracted = list(pool.map(_extract_one, job_args))
+            else:
+                extracted = [_extract_one(args) for args in job_args]
+
+            # Remontar na ordem original; repetições reaproveitam o arquivo
+            # e o base64 da ocorrência dona, mudando só o original_path
+            for img_index, img_path, owner in occurrences:
+                entry = extracted[owner]
+                if entry is None:
+                    continue
+                if entry["original_path"] == img_path:
+                    result["images"].append(entry)
+                else:
+                    result["images"].append(dict(entry, original_path=img_path))
+                    print(f"Imagem {img_index+1} duplicada de {entry['image_filename']}")
             
             # Se não encontramos imagens no método 1, tentar método alternativo
             if len(result["images"]) == 0:
@@ -69,33 +178,36 @@ def extract_images_from_excel(excel_path, output_dir):
                 for rel_file in rels_files:
                     try:
                         with excel_zip.open(rel_file) as f:
-                            rel_content = f.read().decode('utf-8')
-                            # Procurar por referências a imagens
-                            img_refs = re.findall(r'Target="([^"]+\.(?:png|jpe?g|gif|bmp|tiff))"', rel_content)
-                            
+                            # Procurar por referências a imagens no stream
+                            img_refs = _rel_image_targets(f)
+
                             for img_ref in img_refs:
                                 # Tentar construir o caminho completo
                                 rel_dir = os.path.dirname(rel_file)
                                 img_path = os.path.normpath(os.path.join(rel_dir, img_ref))
                                 
                                 try:
+                                    img_filename = os.path.basename(img_path)
+                                    safe_filename = _SAFE_RE.sub('_', img_filename)
+                                    temp_path = os.path.join(output_dir, f"rel_{len(result['images'])}_{safe_filename}")
+
                                     with excel_zip.open(img_path) as img_file:
-                                        img_data = img_file.read()
-                                        img_filename = os.path.basename(img_path)
-                                        safe_filename = re.sub(r'[^\w\-\.]', '_', img_filename)
-                                        temp_path = os.path.join(output_dir, f"rel_{len(result['images'])}_{safe_filename}")
-                                        
-                                        with open(temp_path, 'wb') as out_file:
-                                            out_file.write(img_data)
-                                        
-                                        img_base64 = base64.b64encode(img_data).decode('utf-8')
-                                        
-                                        result["images"].append({
-                                            "image_path": temp_path,
-                                            "image_filename": os.path.basename(temp_path),
-                                            "original_path": img_path,
-                                            "image_base64": img_base64
-                                        })
+                                        if inline_base64:
+                                            img_data = img_file.read()
+                                            with open(temp_path, 'wb') as out_file:
+                                                out_file.write(img_data)
+                                        else:
+                                            with open(temp_path, 'wb') as out_file:
+                                                shutil.copyfileobj(img_file, out_file, 65536)
+
+                                    entry = {
+                                        "image_path": temp_path,
+                                        "image_filename": os.path.basename(temp_path),
+                                        "original_path": img_path
+                                    }
+                                    if inline_base64:
+                                        entry["image_base64"] = _b64_stream(img_data)
+                                    result["images"].append(entry)
                                 except Exception as e:
                                     print(f"Erro ao extrair imagem da referência {img_ref}: {str(e)}")
                     except Exception as e:
@@ -107,15 +219,22 @@ def extract_images_from_excel(excel_path, output_dir):
         result["error"] = str(e)
         print(f"Erro geral: {str(e)}")
     
-    # Retornar o resultado como JSON
-    print(json.dumps(result))
+    # Retornar o resultado como JSON (orjson serializa os blobs base64 sem o
+    # laço de escape por caractere do json puro). flush antes para manter os
+    # prints de progresso acima da linha final
+    sys.stdout.flush()
+    sys.stdout.buffer.write(_dumps(result) + b'\n')
+    sys.stdout.buffer.flush()
     return result
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print(json.dumps({"error": "Argumentos incorretos! Uso: python script.py arquivo.xlsx diretorio_saida"}))
+    # --no-base64 devolve só os caminhos extraídos (sem os blobs no JSON)
+    args = [a for a in sys.argv[1:] if a != "--no-base64"]
+    if len(args) != 2:
+        print(json.dumps({"error": "Argumentos incorretos! Uso: python script.py arquivo.xlsx diretorio_saida [--no-base64]"}))
         sys.exit(1)
-    
-    excel_path = sys.argv[1]
-    output_dir = sys.argv[2]
-    extract_images_from_excel(excel_path, output_dir)
+
+    excel_path = args[0]
+    output_dir = args[1]
+    extract_images_from_excel(excel_path, output_dir,
+                              inline_base64="--no-base64" not in sys.argv)
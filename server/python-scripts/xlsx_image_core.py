@@ -0,0 +1,154 @@
+"""
+Núcleo compartilhado de leitura de imagens de arquivos .xlsx.
+
+Um .xlsx é um ZIP: as imagens ficam em xl/media/ e as âncoras (célula onde
+cada imagem está posicionada) em xl/drawings/drawingN.xml, com o vínculo
+rId -> mídia em xl/drawings/_rels/. Ler essas entradas diretamente evita
+carregar o workbook inteiro com openpyxl (que materializa um objeto por
+célula) só para chegar em sheet._images.
+
+Os scripts extract_excel_images*.py, extract_images_by_row.py e
+extract_image_for_product.py usam estas funções.
+"""
+
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+# Namespaces dos drawings do OOXML (âncoras de imagem)
+NS = {
+    'xdr': 'http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing',
+    'a': 'http://schemas.openxmlformats.org/drawingml/2006/main',
+    'rel': 'http://schemas.openxmlformats.org/package/2006/relationships',
+}
+R_EMBED = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed'
+_MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_R_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+
+
+def rels_map(zip_ref, names, rels_name, base_dir):
+    """Mapa rId -> caminho normalizado no ZIP lido de um arquivo .rels.
+
+    O Target pode ser absoluto ("/xl/media/image1.png") ou relativo ao
+    diretório do .rels ("../media/image1.png"); os dois casos são tratados.
+    """
+    mapping = {}
+    if rels_name in names:
+        try:
+            root = ET.fromstring(zip_ref.read(rels_name))
+            for relationship in root.findall('rel:Relationship', NS):
+                target = relationship.get('Target') or ''
+                if target.startswith('/'):
+                    entry = target.lstrip('/')
+                else:
+                    entry = os.path.normpath(
+                        os.path.join(base_dir, target)).replace('\\', '/')
+                mapping[relationship.get('Id')] = entry
+        except Exception as rels_err:
+            print(f"Erro nas relações {rels_name}: {rels_err}", file=sys.stderr)
+    return mapping
+
+
+def drawing_anchors(zip_ref, names, drawing):
+    """[(linha, coluna, mídia)] de um drawing, células 1-indexadas."""
+    rid_to_media = rels_map(
+        zip_ref, names,
+        'xl/drawings/_rels/' + os.path.basename(drawing) + '.rels',
+        'xl/drawings')
+    anchors = []
+    try:
+        root = ET.fromstring(zip_ref.read(drawing))
+    except Exception as drawing_err:
+        print(f"Erro no drawing {drawing}: {drawing_err}", file=sys.stderr)
+        return anchors
+    # TwoCellAnchor e OneCellAnchor têm a célula inicial em xdr:from
+    for anchor_tag in ('xdr:twoCellAnchor', 'xdr:oneCellAnchor'):
+        for anchor in root.findall(anchor_tag, NS):
+            from_el = anchor.find('xdr:from', NS)
+            blip = anchor.find('.//a:blip', NS)
+            if from_el is None or blip is None:
+                continue
+            row_el = from_el.find('xdr:row', NS)
+            col_el = from_el.find('xdr:col', NS)
+            row = int(row_el.text) + 1 if row_el is not None else 0
+            col = int(col_el.text) + 1 if col_el is not None else 0
+            media_name = rid_to_media.get(blip.get(R_EMBED))
+            if media_name:
+                anchors.append((row, col, media_name))
+    return anchors
+
+
+def collect_anchors(zip_ref, names):
+    """Âncoras de todos os drawings + mídias que ficaram sem âncora.
+
+    Devolve ([(linha, coluna, mídia)], [mídias sem âncora]); as mídias sem
+    âncora são devolvidas à parte para cada script decidir o sentinela.
+    """
+    anchors = []
+    for drawing in (n for n in names
+                    if n.startswith('xl/drawings/') and n.endswith('.xml')):
+        anchors.extend(drawing_anchors(zip_ref, names, drawing))
+    anchored = {m for _, _, m in anchors}
+    unanchored = [n for n in names
+                  if n.startswith('xl/media/') and n not in anchored]
+    return anchors, unanchored
+
+
+def sheet_anchors(zip_ref, names):
+    """[(planilha, linha, coluna, mídia)] na ordem das planilhas do workbook.
+
+    O encadeamento é workbook.xml (nome + r:id) -> workbook.xml.rels
+    (r:id -> sheetN.xml) -> sheetN.xml.rels (drawing da planilha). Drawings
+    que não puderem ser ligados a uma planilha entram no final com None.
+    """
+    sheet_targets = []
+    try:
+        wb_root = ET.fromstring(zip_ref.read('xl/workbook.xml'))
+        wb_rels = rels_map(zip_ref, names, 'xl/_rels/workbook.xml.rels', 'xl')
+        for sheet in wb_root.iter('{%s}sheet' % _MAIN_NS):
+            target = wb_rels.get(sheet.get('{%s}id' % _R_NS))
+            if target:
+                sheet_targets.append((sheet.get('name'), target))
+    except Exception as wb_err:
+        print(f"Erro ao ler workbook.xml: {wb_err}", file=sys.stderr)
+
+    results = []
+    seen_drawings = set()
+    for sheet_name, ws_path in sheet_targets:
+        ws_rels = rels_map(
+            zip_ref, names,
+            'xl/worksheets/_rels/' + os.path.basename(ws_path) + '.rels',
+            'xl/worksheets')
+        for target in ws_rels.values():
+            if (target.startswith('xl/drawings/') and target.endswith('.xml')
+                    and target in names and target not in seen_drawings):
+                seen_drawings.add(target)
+                for row, col, media_name in drawing_anchors(zip_ref, names, target):
+                    results.append((sheet_name, row, col, media_name))
+
+    for drawing in (n for n in names
+                    if n.startswith('xl/drawings/') and n.endswith('.xml')):
+        if drawing not in seen_drawings:
+            for row, col, media_name in drawing_anchors(zip_ref, names, drawing):
+                results.append((None, row, col, media_name))
+    return results
+
+
+def image_format(image_data):
+    """(extensão, MIME) deduzidos dos bytes mágicos; PNG como padrão.
+
+    As mídias de xl/media/ são repassadas como vieram — detectar o
+    contêiner real evita rotular JPEG/GIF como .png e induzir algum
+    consumidor a re-encodar a imagem.
+    """
+    if image_data[:4] == b'\x89PNG':
+        return 'png', 'image/png'
+    if image_data[:3] == b'\xff\xd8\xff':
+        return 'jpg', 'image/jpeg'
+    if image_data[:4] == b'GIF8':
+        return 'gif', 'image/gif'
+    if image_data[:4] == b'RIFF' and image_data[8:12] == b'WEBP':
+        return 'webp', 'image/webp'
+    if image_data[:2] == b'BM':
+        return 'bmp', 'image/bmp'
+    return 'png', 'image/png'
@@ -1,8 +1,61 @@
+import concurrent.futures
 import fitz  # PyMuPDF
 import sys
 import json
 import os
 
+try:
+    import orjson
+    def _dumps(obj):
+        return orjson.dumps(obj)
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+def _extract_one_page(pdf_path, page_num, output_dir, xrefs=None):
+    """
+    Extrai as imagens de uma única página; roda em um processo worker.
+    O Document do MuPDF não pode ser compartilhado entre processos, então
+    cada worker abre o seu próprio e devolve a lista de dicts da página.
+    Com `xrefs`, só os XObjects listados são decodificados — os demais são
+    duplicatas que o chamador resolve sem novo extract_image.
+    """
+    page_images_info = []
+    doc = fitz.open(pdf_path)
+    try:
+        # get_page_images lê o dicionário de recursos direto do xref, sem
+        # materializar o objeto Page (parse do content stream + display list)
+        # que load_page pagaria só para enumerar as imagens
+        image_list = doc.get_page_images(page_num, full=True)
+
+        for img_index, img_info in enumerate(image_list):
+            xref = img_info[0]
+            if xrefs is not None and xref not in xrefs:
+                continue
+            base_image = doc.extract_image(xref)
+            image_bytes = base_image["image"]
+            image_ext = base_image["ext"]
+
+            image_filename = f"page{page_num + 1}_img{img_index + 1}.{image_ext}"
+            image_filepath = os.path.join(output_dir, image_filename)
+
+            with open(image_filepath, "wb") as img_file:
+                img_file.write(image_bytes)
+
+            page_images_info.append({
+                "page_number": page_num + 1,
+                "image_index_on_page": img_index + 1,
+                "filename": image_filename,
+                "filepath": image_filepath,
+                "extension": image_ext,
+                "xref": xref,
+                # PyMuPDF não fornece dimensões diretamente neste fluxo de forma simples
+                # Para dimensões, precisaríamos de etapas adicionais (ex: carregar com Pillow)
+            })
+    finally:
+        doc.close()
+    return page_images_info
+
 def extract_images_from_pdf(pdf_path, output_dir):
     """
     Extrai imagens de um arquivo PDF e as salva no diretório de saída.
@@ -12,38 +65,71 @@ def extract_images_from_pdf(pdf_path, output_dir):
     try:
         if not os.path.exists(pdf_path):
             return {"error": f"Arquivo PDF não encontrado: {pdf_path}"}
-        
-        doc = fitz.open(pdf_path)
+
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
 
+        # Catálogos referenciam o mesmo XObject em várias páginas; enumerar
+        # os xrefs primeiro (barato, sem decodificar nada) permite extrair
+        # cada um uma única vez — a primeira página onde aparece é a "dona"
+        doc = fitz.open(pdf_path)
+        occurrences = []  # (página, índice na página, xref), na ordem do PDF
+        owner_page = {}   # xref -> página dona
         for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            image_list = page.get_images(full=True)
-            
-            for img_index, img_info in enumerate(image_list):
+            for img_index, img_info in enumerate(doc.get_page_images(page_num, full=True)):
                 xref = img_info[0]
-                base_image = doc.extract_image(xref)
-                image_bytes = base_image["image"]
-                image_ext = base_image["ext"]
-                
-                image_filename = f"page{page_num + 1}_img{img_index + 1}.{image_ext}"
-                image_filepath = os.path.join(output_dir, image_filename)
-                
-                with open(image_filepath, "wb") as img_file:
-                    img_file.write(image_bytes)
-                
+                occurrences.append((page_num, img_index, xref))
+                owner_page.setdefault(xref, page_num)
+        doc.close()
+
+        xrefs_by_page = {}
+        for xref, page_num in owner_page.items():
+            xrefs_by_page.setdefault(page_num, set()).add(xref)
+        pages_to_extract = sorted(xrefs_by_page)
+
+        # Decodificação Flate/DCT é CPU-bound e independente por página;
+        # acima de 4 workers a disputa de I/O come o ganho. map preserva a
+        # ordem das páginas no resultado.
+        pages_info = []
+        if len(pages_to_extract) > 1:
+            max_workers = min(os.cpu_count() or 1, 4)
+            with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as pool:
+                pages_info = list(pool.map(
+                    _extract_one_page,
+                    [pdf_path] * len(pages_to_extract),
+                    pages_to_extract,
+                    [output_dir] * len(pages_to_extract),
+                    [xrefs_by_page[p] for p in pages_to_extract]))
+        else:
+            for page_num in pages_to_extract:
+                pages_info.append(_extract_one_page(
+                    pdf_path, page_num, output_dir, xrefs_by_page[page_num]))
+
+        info_by_xref = {}
+        for page_images_info in pages_info:
+            for image_info in page_images_info:
+                info_by_xref[image_info["xref"]] = image_info
+
+        # Remontar a lista na ordem original; ocorrências repetidas apontam
+        # para o arquivo já gravado pela página dona
+        for page_num, img_index, xref in occurrences:
+            owner_info = info_by_xref.get(xref)
+            if owner_info is None:
+                continue
+            if (owner_info["page_number"] == page_num + 1
+                    and owner_info["image_index_on_page"] == img_index + 1):
+                extracted_images_info.append(owner_info)
+            else:
                 extracted_images_info.append({
                     "page_number": page_num + 1,
                     "image_index_on_page": img_index + 1,
-                    "filename": image_filename,
-                    "filepath": image_filepath,
-                    "extension": image_ext,
-                    # PyMuPDF não fornece dimensões diretamente neste fluxo de forma simples
-                    # Para dimensões, precisaríamos de etapas adicionais (ex: carregar com Pillow)
+                    "filename": owner_info["filename"],
+                    "filepath": owner_info["filepath"],
+                    "extension": owner_info["extension"],
+                    "xref": xref,
+                    "duplicate_of_xref": xref,
                 })
-        
-        doc.close()
+
         return {"success": True, "images": extracted_images_info}
 
     except Exception as e:
@@ -53,9 +139,9 @@ if __name__ == "__main__":
     if len(sys.argv) != 3:
         print(json.dumps({"error": "Uso: python extract_pdf_images.py <caminho_do_pdf> <diretorio_de_saida>"}))
         sys.exit(1)
-    
+
     pdf_file_path = sys.argv[1]
     output_image_dir = sys.argv[2]
-    
+
     result = extract_images_from_pdf(pdf_file_path, output_image_dir)
-    print(json.dumps(result)) 
\ No newline at end of file
+    sys.stdout.buffer.write(_dumps(result) + b'\n')
\ No newline at end of file